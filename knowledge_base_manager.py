@@ -1,36 +1,206 @@
 import os
+import io
+import re
+import json
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import PyPDF2
 from docx import Document
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Pre-exported int8 (dynamically quantized) ONNX weights shipped with the model
+QUANTIZED_ONNX_FILE = 'onnx/model_qint8_avx512_vnni.onnx'
+
+# Number of chunks per embedding forward pass during ingestion
+EMBEDDING_BATCH_SIZE = 1024
+
+# PDFs with at least this many pages have their text extracted in a process pool
+PARALLEL_PDF_MIN_PAGES = 32
+
+# Rows checked for unit norm when memory-mapping a saved embedding matrix
+EMBEDDING_NORM_SAMPLE = 256
+
+# Maximum number of query embeddings kept in the LRU query cache
+QUERY_CACHE_SIZE = 1024
+
+# Concurrent searches are embedded together: up to QUERY_BATCH_MAX queries
+# arriving within QUERY_BATCH_WINDOW_SEC of each other share one forward pass
+QUERY_BATCH_MAX = 16
+QUERY_BATCH_WINDOW_SEC = 0.008
+# How long a search waits for its batched embedding before embedding the query itself
+QUERY_BATCH_TIMEOUT_SEC = 5.0
+
+# Word tokens used for keyword boosting (query keywords and the inverted index)
+_TOKEN_RE = re.compile(r"\w+")
+# Whitespace-delimited words used for chunking
+_WORD_RE = re.compile(r"\S+")
+
+
+# Embedding models shared by all KnowledgeBase instances, keyed by backend
+_EMBEDDING_MODELS: Dict[str, SentenceTransformer] = {}
+_EMBEDDING_MODELS_LOCK = threading.Lock()
+
+
+def get_embedding_model(backend: str = "torch") -> SentenceTransformer:
+    """Return the process-wide embedding model for a backend, loading it on first use."""
+    with _EMBEDDING_MODELS_LOCK:
+        if backend not in _EMBEDDING_MODELS:
+            logger.info(f"Loading embedding model ({backend} backend)...")
+            _EMBEDDING_MODELS[backend] = _load_embedding_model(backend)
+        return _EMBEDDING_MODELS[backend]
+
+
+def _load_embedding_model(backend: str = "torch") -> SentenceTransformer:
+    """Load the sentence embedding model.
+    
+    backend="onnx" uses the int8-quantized ONNX export of the model, which is
+    several times faster on CPU; it needs `optimum[onnxruntime]` and falls back
+    to the default PyTorch model if it cannot be loaded.
+    """
+    if backend == "onnx":
+        try:
+            return SentenceTransformer(
+                EMBEDDING_MODEL_NAME,
+                backend='onnx',
+                model_kwargs={'file_name': QUANTIZED_ONNX_FILE}
+            )
+        except Exception as e:
+            logger.warning(f"Could not load quantized ONNX embedding model, falling back to PyTorch: {e}")
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+
+# PDF reader of the current process-pool worker (see _init_pdf_worker)
+_worker_pdf_reader = None
+
+
+def _init_pdf_worker(pdf_bytes: bytes):
+    """Process-pool initializer: parse the PDF once per worker process."""
+    global _worker_pdf_reader
+    _worker_pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+
+
+def _extract_pdf_page(page_index: int) -> str:
+    """Extract the text of one page in a process-pool worker."""
+    return _worker_pdf_reader.pages[page_index].extract_text() or ""
+
+
+def extract_pdf_text(pdf_path: str, parallel: bool = False) -> str:
+    """Extract the text of a PDF, one line-separated block per page.
+    
+    PyPDF2 extraction is pure Python and CPU-bound, so with parallel=True
+    large PDFs are split across a process pool; pages are returned in
+    document order. Only use parallel=True from an `if __name__ == "__main__":`
+    guarded entry point: under the spawn and forkserver start methods every
+    worker re-imports the main module.
+    """
+    with open(pdf_path, 'rb') as file:
+        pdf_bytes = file.read()
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    n_pages = len(pdf_reader.pages)
+    workers = min(os.cpu_count() or 1, n_pages // 4)
+    
+    pages = None
+    if parallel and n_pages >= PARALLEL_PDF_MIN_PAGES and workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_pdf_worker,
+                                     initargs=(pdf_bytes,)) as executor:
+                pages = list(executor.map(_extract_pdf_page, range(n_pages), chunksize=4))
+        except Exception as e:
+            logger.warning(f"Parallel extraction failed for {pdf_path}, extracting serially: {e}")
+    if pages is None:
+        pages = [page.extract_text() or "" for page in pdf_reader.pages]
+    
+    return "\n".join(pages)
+
+
+def pdf_category(filename: str):
+    """Auto-detect a document category from a PDF's filename."""
+    filename = filename.lower()
+    if 'emp' in filename:
+        return 'employment'
+    elif 'edu' in filename:
+        return 'education'
+    elif 'add' in filename or 'address' in filename:
+        return 'address'
+    elif 'misc' in filename or 'criminal' in filename:
+        return 'compliance'  # MISC_PM contains red flags, criminal checks, etc.
+    return None
+
+
+def _extract_pdf_document(pdf_path: str):
+    """Process-pool task for KnowledgeBase.add_pdfs: the text of one PDF, or None on error."""
+    try:
+        return extract_pdf_text(pdf_path, parallel=False)
+    except Exception as e:
+        logger.error(f"Error processing PDF {pdf_path}: {e}")
+        return None
+
 
 class KnowledgeBase:
     """Manages document storage, embedding, and retrieval for the Slack bot."""
     
-    def __init__(self, knowledge_base_path: str = "./knowledge_base"):
+    def __init__(self, knowledge_base_path: str = "./knowledge_base", embedding_backend: str = "torch",
+                 embed_cache_dir: str = None):
         self.knowledge_base_path = knowledge_base_path
         self.metadata_path = os.path.join(knowledge_base_path, "metadata.json")
         self.embeddings_path = os.path.join(knowledge_base_path, "embeddings.npy")
+        # Legacy pickle index, migrated to JSON + numpy on first load
+        self.index_path = os.path.join(knowledge_base_path, "embeddings.pkl")
         
-        # Initialize embedding model
-        logger.info("Loading embedding model...")
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Initialize embedding model (shared across instances)
+        self.embedding_backend = embedding_backend
+        self.embedding_model = get_embedding_model(embedding_backend)
+        self.embedding_dim = self.embedding_model.get_sentence_embedding_dimension()
         
-        # Storage for documents, metadata, and embeddings
+        # Optional on-disk cache of document embeddings, keyed by a hash of the
+        # model and the document's chunks, so re-indexing unchanged files skips the encoder
+        self.embed_cache_dir = embed_cache_dir
+        if embed_cache_dir:
+            os.makedirs(embed_cache_dir, exist_ok=True)
+        # Cache files used by the documents added since the index was last empty;
+        # None when the index was loaded from disk, as its files are then unknown
+        self._embed_cache_used = set()
+        
+        # Storage for documents, metadata, and embeddings. Embeddings live in a
+        # preallocated float32 matrix (L2-normalized rows) that grows geometrically;
+        # only the first `_size` rows are valid.
         self.documents = []
         self.metadatas = []
-        self.embeddings = []
+        self._emb = np.empty((0, self.embedding_dim), dtype=np.float32)
+        self._size = 0
+        
+        # Inverted index of lowercased word tokens -> ids of the chunks containing them
+        self._inverted_index = {}
         
-        # Load existing index if available (check for new JSON/numpy format)
-        if os.path.exists(self.metadata_path) and os.path.exists(self.embeddings_path):
+        # LRU cache of query embeddings, keyed by a content hash of model + query
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        
+        # Metadata field -> value -> sorted chunk ids, for collection/category
+        # filtering; rebuilt lazily after the index or its metadata changes
+        self._filter_index = None
+        
+        # Unsaved changes, and whether saving is deferred to the end of a bulk load
+        self._dirty = False
+        self._bulk = False
+        
+        # Load existing index if available (JSON/numpy format, or a legacy pickle to migrate)
+        has_index = os.path.exists(self.metadata_path) and os.path.exists(self.embeddings_path)
+        if has_index or os.path.exists(self.index_path):
             self._load_index()
+            if self.documents:
+                self._embed_cache_used = None
         else:
             logger.info("Created new knowledge base")
     
@@ -41,53 +211,146 @@ class KnowledgeBase:
         
         # Create chunks of text
         chunks = self._chunk_text(text)
-        
-        for i, chunk in enumerate(chunks):
-            # Generate embedding
-            embedding = self.embedding_model.encode(chunk)
-            
-            # Store document, metadata, and embedding
-            self.documents.append(chunk)
-            self.embeddings.append(embedding)
-            
+        metadatas = []
+        for i in range(len(chunks)):
             meta = dict(metadata or {})
             meta['chunk_index'] = i
-            self.metadatas.append(meta)
+            metadatas.append(meta)
+        
+        self._add_chunks(chunks, metadatas, self._embed_documents([chunks])[0])
+    
+    def _embed_documents(self, documents: List[List[str]]) -> List[np.ndarray]:
+        """Embeddings for the chunks of each document.
+        
+        Documents found in the embed cache are loaded from disk; all other
+        chunks are embedded together in one batched forward pass.
+        """
+        embeddings = [None] * len(documents)
+        cache_paths = [None] * len(documents)
+        if self.embed_cache_dir:
+            for i, chunks in enumerate(documents):
+                digest = hashlib.sha1(
+                    f"{EMBEDDING_MODEL_NAME}|{self.embedding_backend}".encode('utf-8')
+                )
+                for chunk in chunks:
+                    digest.update(b"\0" + chunk.encode('utf-8'))
+                cache_paths[i] = os.path.join(self.embed_cache_dir, f"{digest.hexdigest()}.npy")
+                if self._embed_cache_used is not None:
+                    self._embed_cache_used.add(os.path.basename(cache_paths[i]))
+                try:
+                    cached = np.load(cache_paths[i], allow_pickle=False)
+                    if cached.shape == (len(chunks), self.embedding_dim):
+                        embeddings[i] = cached
+                except (OSError, ValueError):
+                    pass
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+        
+        encoded = self.embedding_model.encode(
+            [chunk for i in missing for chunk in documents[i]],
+            batch_size=EMBEDDING_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        offset = 0
+        for i in missing:
+            embeddings[i] = encoded[offset:offset + len(documents[i])]
+            offset += len(documents[i])
+            if cache_paths[i]:
+                try:
+                    np.save(cache_paths[i], np.asarray(embeddings[i], dtype=np.float32))
+                except OSError as e:
+                    logger.warning(f"Could not write embedding cache: {e}")
+        return embeddings
+    
+    def _add_chunks(self, chunks: List[str], metadatas: List[Dict], embeddings: np.ndarray):
+        """Store chunks with their metadata and (normalized) embeddings."""
+        # Store documents, metadata, and embeddings
+        first_id = len(self.documents)
+        self.documents.extend(chunks)
+        self._append_embeddings(embeddings)
+        self._index_tokens(chunks, first_id)
+        self._filter_index = None
+        self.metadatas.extend(metadatas)
         
         logger.info(f"Added {len(chunks)} chunks to knowledge base")
-        self._save_index()
+        self._dirty = True
+        if not self._bulk:
+            self.flush()
     
-    def add_pdf(self, pdf_path: str):
-        """Extract text from PDF and add to knowledge base."""
+    def add_pdf(self, pdf_path: str, parallel: bool = False):
+        """Extract text from PDF and add to knowledge base.
+        
+        parallel=True extracts large PDFs in a process pool (see extract_pdf_text).
+        """
         try:
-            filename = os.path.basename(pdf_path).lower()
+            category = pdf_category(os.path.basename(pdf_path))
+            text = extract_pdf_text(pdf_path, parallel=parallel)
             
-            # Auto-detect document category from filename
-            category = None
-            if 'emp' in filename:
-                category = 'employment'
-            elif 'edu' in filename:
-                category = 'education'
-            elif 'add' in filename or 'address' in filename:
-                category = 'address'
-            elif 'misc' in filename or 'criminal' in filename:
-                category = 'compliance'  # MISC_PM contains red flags, criminal checks, etc.
+            metadata = {"source": os.path.basename(pdf_path), "type": "pdf"}
+            if category:
+                metadata['category'] = category
             
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                
-                metadata = {"source": os.path.basename(pdf_path), "type": "pdf"}
-                if category:
-                    metadata['category'] = category
-                
-                self.add_text(text, metadata=metadata)
-                logger.info(f"Added PDF: {pdf_path} (category: {category})")
+            self.add_text(text, metadata=metadata)
+            logger.info(f"Added PDF: {pdf_path} (category: {category})")
         except Exception as e:
             logger.error(f"Error processing PDF {pdf_path}: {e}")
     
+    def add_pdfs(self, pdf_paths: List[str], collections: List[str] = None):
+        """Add several PDFs, extracting their text in parallel worker processes.
+        
+        Text extraction is spread over a process pool; chunking and embedding
+        stay in this process (which holds the model), with the chunks of all
+        PDFs (that aren't in the embed cache) embedded in a single batched
+        encode call. Like extract_pdf_text(parallel=True), only call this from
+        a `__main__`-guarded entry point.
+        
+        Args:
+            pdf_paths: Paths of the PDFs to add
+            collections: Optional collection label for each PDF, parallel to pdf_paths
+        """
+        if not pdf_paths:
+            return
+        
+        texts = None
+        workers = min(os.cpu_count() or 1, len(pdf_paths))
+        if workers > 1:
+            try:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    texts = list(executor.map(_extract_pdf_document, pdf_paths))
+            except Exception as e:
+                logger.warning(f"Parallel PDF extraction failed, extracting serially: {e}")
+        if texts is None:
+            texts = [_extract_pdf_document(path) for path in pdf_paths]
+        
+        all_chunks = []
+        all_metadatas = []
+        documents = []
+        for i, (pdf_path, text) in enumerate(zip(pdf_paths, texts)):
+            if text is None or not text.strip():
+                continue
+            
+            metadata = {"source": os.path.basename(pdf_path), "type": "pdf"}
+            category = pdf_category(metadata['source'])
+            if category:
+                metadata['category'] = category
+            if collections is not None and collections[i] is not None:
+                metadata['collection'] = collections[i]
+            
+            chunks = self._chunk_text(text)
+            documents.append(chunks)
+            all_chunks.extend(chunks)
+            for chunk_index in range(len(chunks)):
+                all_metadatas.append(dict(metadata, chunk_index=chunk_index))
+            logger.info(f"Extracted PDF: {pdf_path} (category: {category})")
+        
+        if all_chunks:
+            embeddings = np.concatenate(self._embed_documents(documents))
+            self._add_chunks(all_chunks, all_metadatas, embeddings)
+    
     def add_docx(self, docx_path: str):
         """Extract text from DOCX and add to knowledge base."""
         try:
@@ -116,9 +379,18 @@ class KnowledgeBase:
         except Exception as e:
             logger.error(f"Error processing TXT {txt_path}: {e}")
     
-    def load_documents_from_folder(self, folder_path: str, collection_name: str = None):
-        """Load all supported documents from a folder."""
+    def load_documents_from_folder(self, folder_path: str, collection_name: str = None,
+                                   extensions: set = None, bulk: bool = False):
+        """Load all supported documents from a folder.
+        
+        Args:
+            extensions: Only load files with these extensions (default: .pdf, .docx, .txt)
+            bulk: The folder is part of a larger load; load it even if the knowledge
+                base already has documents, and leave saving to the caller's flush()
+        """
         supported_extensions = {'.pdf', '.docx', '.txt'}
+        if extensions is not None:
+            supported_extensions &= set(extensions)
         
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
@@ -126,7 +398,7 @@ class KnowledgeBase:
             return
 
         # Skip if KB already loaded to avoid re-indexing
-        if len(self.documents) > 0:
+        if not bulk and len(self.documents) > 0:
             logger.info(f"Knowledge base already loaded with {len(self.documents)} documents, skipping re-index of {folder_path}")
             return
 
@@ -141,33 +413,51 @@ class KnowledgeBase:
         except Exception:
             collection = collection_name
 
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            
-            # Skip if it's a directory or our index file
-            if os.path.isdir(file_path) or filename == 'embeddings.pkl':
-                continue
-            
-            _, ext = os.path.splitext(filename)
-            
-            if ext.lower() in supported_extensions:
-                # Track how many documents were added before this file
-                docs_before = len(self.documents)
+        # Save once after the whole folder instead of after every file
+        self._bulk = True
+        try:
+            with os.scandir(folder_path) as it:
+                entries = list(it)
+            for entry in entries:
+                filename = entry.name
+                file_path = entry.path
                 
-                if ext == '.pdf':
-                    self.add_pdf(file_path)
-                elif ext == '.docx':
-                    self.add_docx(file_path)
-                elif ext == '.txt':
-                    self.add_txt(file_path)
+                # Skip if it's a directory or our index file
+                if entry.is_dir() or filename == 'embeddings.pkl':
+                    continue
                 
-                # Add collection label to ALL newly added metadata entries
-                if collection is not None:
-                    docs_added = len(self.documents) - docs_before
-                    for i in range(docs_before, len(self.documents)):
-                        self.metadatas[i]['collection'] = collection
+                _, ext = os.path.splitext(filename)
+                
+                if ext.lower() in supported_extensions:
+                    # Track how many documents were added before this file
+                    docs_before = len(self.documents)
+                    
+                    if ext == '.pdf':
+                        self.add_pdf(file_path)
+                    elif ext == '.docx':
+                        self.add_docx(file_path)
+                    elif ext == '.txt':
+                        self.add_txt(file_path)
+                    
+                    # Add collection label to ALL newly added metadata entries
+                    if collection is not None:
+                        docs_added = len(self.documents) - docs_before
+                        for i in range(docs_before, len(self.documents)):
+                            self.metadatas[i]['collection'] = collection
+                        self._filter_index = None
+        finally:
+            self._bulk = False
+            if not bulk:
+                self.flush()
     
-    def search(self, query: str, n_results: int = 3, collection_name: str = None, category: str = None) -> List[Dict]:
+    def search(
+        self,
+        query: str,
+        n_results: int = 3,
+        collection_name: str = None,
+        category: str = None,
+        query_embedding: Optional[np.ndarray] = None
+    ) -> List[Dict]:
         """Search the knowledge base for relevant information using hybrid search.
         
         Args:
@@ -175,119 +465,267 @@ class KnowledgeBase:
             n_results: Number of results to return
             collection_name: Filter by collection (e.g., 'springworks')
             category: Filter by document category (e.g., 'employment', 'education', 'address')
+            query_embedding: Precomputed embedding of the query (see QueryBatcher)
         """
         if len(self.documents) == 0:
             return []
         
-        # Encode query
-        query_embedding = self.embedding_model.encode(query)
+        # Encode query (cached for repeated queries)
+        if query_embedding is None:
+            query_embedding = self._encode_query(query)
         
         # Extract keywords from query for boosting
-        query_keywords = set(query.lower().split())
+        query_keywords = set(_TOKEN_RE.findall(query.lower()))
         
         # Calculate cosine similarities
         # If a collection is specified, filter to only those documents
         if collection_name:
-            filtered_indices = [i for i, m in enumerate(self.metadatas) if m.get('collection') == collection_name]
-            if not filtered_indices:
+            filtered_indices = self._filter_ids('collection', collection_name)
+            if len(filtered_indices) == 0:
                 return []
             
             # Further filter by category if specified
             if category:
-                category_indices = [i for i in filtered_indices if self.metadatas[i].get('category') == category]
-                if category_indices:
+                category_indices = np.intersect1d(
+                    filtered_indices, self._filter_ids('category', category), assume_unique=True
+                )
+                if len(category_indices) > 0:
                     filtered_indices = category_indices
                     logger.info(f"Filtered to {len(filtered_indices)} documents in category '{category}'")
                 else:
                     logger.info(f"No documents found in category '{category}'")
                     return []
             
-            embeddings_array = np.array([self.embeddings[i] for i in filtered_indices])
-            similarities = cosine_similarity([query_embedding], embeddings_array)[0]
+            similarities = self._score(query_embedding, filtered_indices)
 
             # Apply keyword boosting
-            boosted_similarities = []
-            for i, sim in enumerate(similarities):
-                doc_idx = filtered_indices[i]
-                doc_text = self.documents[doc_idx].lower()
-                
-                # Count keyword matches
-                keyword_matches = sum(1 for kw in query_keywords if kw in doc_text)
-                
-                # Boost score based on keyword matches
-                # Each keyword match adds 0.15 to similarity (max boost of 0.7)
-                boost = min(keyword_matches * 0.15, 0.7)
-                boosted_similarities.append(sim + boost)
-            
-            boosted_similarities = np.array(boosted_similarities)
+            # Each keyword match adds 0.15 to similarity (max boost of 0.7)
+            boosted_similarities = similarities + self._keyword_boost(query_keywords, filtered_indices, 0.15, 0.7)
 
             # Get top k results relative to the filtered set
             k = min(n_results, len(filtered_indices))
-            top_rel_indices = np.argsort(boosted_similarities)[-k:][::-1]
+            top_rel_indices = self._top_k(boosted_similarities, k)
             top_indices = [filtered_indices[i] for i in top_rel_indices]
             final_similarities = boosted_similarities
         else:
             # No collection filter, but may filter by category
             if category:
                 # Filter to only documents in specified category
-                filtered_indices = [i for i, m in enumerate(self.metadatas) if m.get('category') == category]
-                if not filtered_indices:
+                filtered_indices = self._filter_ids('category', category)
+                if len(filtered_indices) == 0:
                     logger.info(f"No documents found in category '{category}'")
                     return []
             else:
                 # No category filter either, use all documents
-                filtered_indices = list(range(len(self.documents)))
+                filtered_indices = np.arange(self._size)
             
-            embeddings_array = np.array([self.embeddings[i] for i in filtered_indices])
-            similarities = cosine_similarity([query_embedding], embeddings_array)[0]
+            similarities = self._score(query_embedding, filtered_indices)
             
             # Apply keyword boosting to filtered documents
-            boosted_similarities = []
-            for i, sim in enumerate(similarities):
-                doc_idx = filtered_indices[i]
-                doc_text = self.documents[doc_idx].lower()
-                
-                # Count keyword matches
-                keyword_matches = sum(1 for kw in query_keywords if kw in doc_text)
-                
-                # Boost score based on keyword matches
-                boost = min(keyword_matches * 0.1, 0.5)
-                boosted_similarities.append(sim + boost)
-            
-            boosted_similarities = np.array(boosted_similarities)
+            boosted_similarities = similarities + self._keyword_boost(query_keywords, filtered_indices, 0.1, 0.5)
             
             # Get top k results relative to the filtered set
             k = min(n_results, len(filtered_indices))
-            top_rel_indices = np.argsort(boosted_similarities)[-k:][::-1]
+            top_rel_indices = self._top_k(boosted_similarities, k)
             top_indices = [filtered_indices[i] for i in top_rel_indices]
             final_similarities = boosted_similarities
         
-        # Format results
+        # Format results; 'source' is copied to the top level for citation builders
         formatted_results = []
-        for rank, idx in enumerate(top_indices):
-            # Determine similarity value (always use rank since both branches now use filtered_indices)
+        for rel_idx, idx in zip(top_rel_indices, top_indices):
             try:
-                sim_value = float(1 - final_similarities[rank])
+                sim_value = float(1 - final_similarities[rel_idx])
             except Exception:
                 sim_value = 0.0
 
+            metadata = self.metadatas[idx]
             formatted_results.append({
                 'content': self.documents[idx],
-                'metadata': self.metadatas[idx],
+                'metadata': metadata,
+                'source': metadata.get('source'),
                 'distance': sim_value
             })
         
         return formatted_results
     
+    def _score(self, query_embedding: np.ndarray, indices: List[int]) -> np.ndarray:
+        """Cosine similarity of the query against the given documents.
+        
+        Stored vectors are L2-normalized on insertion, so cosine reduces to a
+        single matrix-vector product over the float32 embedding matrix.
+        """
+        # Kept in float32 on purpose: NumPy has no int8/fp16 BLAS kernels, so
+        # quantized matrices score slower than the float32 matvec despite the
+        # smaller memory footprint.
+        query = self._normalize(query_embedding)
+        if len(indices) == self._size:
+            return self.embeddings @ query
+        return self.embeddings[indices] @ query
+    
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k highest scores, best first.
+        
+        Uses a linear-time partial selection and only sorts the k winners,
+        instead of sorting every score.
+        """
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(scores, -k)[-k:]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(scores[candidates])[::-1]]
+    
+    def _encode_query(self, query: str) -> np.ndarray:
+        """Return the normalized embedding for a query, reusing cached vectors."""
+        return self.encode_queries([query])[0]
+    
+    def encode_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """Return normalized embeddings for several queries.
+        
+        Cached vectors are reused; the remaining queries are embedded together
+        in a single encode call.
+        """
+        keys = [
+            hashlib.blake2b(f"{EMBEDDING_MODEL_NAME}||{query}".encode('utf-8'), digest_size=16).digest()
+            for query in queries
+        ]
+        embeddings = [None] * len(queries)
+        with self._query_cache_lock:
+            for i, key in enumerate(keys):
+                cached = self._query_cache.get(key)
+                if cached is not None:
+                    self._query_cache.move_to_end(key)
+                    embeddings[i] = cached
+        
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if not missing:
+            return embeddings
+        
+        encoded = self.embedding_model.encode(
+            [queries[i] for i in missing],
+            batch_size=len(missing),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        with self._query_cache_lock:
+            for i, embedding in zip(missing, encoded):
+                embedding.setflags(write=False)
+                embeddings[i] = embedding
+                self._query_cache[keys[i]] = embedding
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return embeddings
+    
+    def _filter_ids(self, field: str, value) -> np.ndarray:
+        """Sorted ids of the chunks whose metadata `field` equals `value`."""
+        if self._filter_index is None:
+            filter_index = {'collection': {}, 'category': {}}
+            for i, meta in enumerate(self.metadatas):
+                for name, ids_by_value in filter_index.items():
+                    ids_by_value.setdefault(meta.get(name), []).append(i)
+            self._filter_index = {
+                name: {v: np.array(ids, dtype=np.int64) for v, ids in ids_by_value.items()}
+                for name, ids_by_value in filter_index.items()
+            }
+        return self._filter_index[field].get(value, np.empty(0, dtype=np.int64))
+    
+    def _keyword_boost(self, keywords, indices: List[int], per_match: float, max_boost: float) -> np.ndarray:
+        """Keyword boost for the given documents, looked up in the inverted index.
+        
+        Each query keyword that occurs in a chunk adds `per_match`, capped at `max_boost`.
+        """
+        postings = [self._inverted_index[kw] for kw in keywords if kw in self._inverted_index]
+        if not postings:
+            return np.zeros(len(indices), dtype=np.float32)
+        
+        # Count matches per chunk in a single C-level pass over all posting lists
+        matches = np.bincount(np.concatenate(postings), minlength=self._size)
+        boost = np.minimum(matches.astype(np.float32) * per_match, max_boost)
+        if len(indices) == self._size:
+            return boost
+        return boost[indices]
+    
+    def _index_tokens(self, chunks: List[str], first_id: int = 0):
+        """Add chunks (with consecutive ids starting at first_id) to the inverted index."""
+        for doc_id, chunk in enumerate(chunks, first_id):
+            for token in set(_TOKEN_RE.findall(chunk.lower())):
+                self._inverted_index.setdefault(token, []).append(doc_id)
+    
+    @property
+    def embeddings(self) -> np.ndarray:
+        """View of the stored (normalized, float32) embeddings, one row per chunk."""
+        return self._emb[:self._size]
+    
+    def _set_embeddings(self, vectors):
+        """Replace all stored embeddings."""
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(-1, self.embedding_dim)
+        self._emb = np.ascontiguousarray(self._normalize(matrix))
+        self._size = len(matrix)
+    
+    def _load_embeddings(self, embeddings_path: str):
+        """Memory-map saved embeddings so pages are read from disk on demand.
+        
+        The mapping is read-only; the first append copies the rows into a
+        regular in-memory matrix (see _append_embeddings). Files that aren't
+        float32 with L2-normalized rows (e.g. written by older versions) are
+        loaded into memory and normalized instead, since search scores are dot
+        products that assume unit rows.
+        """
+        matrix = np.load(embeddings_path, mmap_mode='r', allow_pickle=False)
+        if (matrix.dtype == np.float32 and matrix.ndim == 2 and matrix.shape[1] == self.embedding_dim
+                and self._rows_normalized(matrix)):
+            self._emb = matrix
+            self._size = len(matrix)
+        else:
+            self._set_embeddings(matrix)
+    
+    @staticmethod
+    def _rows_normalized(matrix: np.ndarray, sample_size: int = EMBEDDING_NORM_SAMPLE) -> bool:
+        """Whether an evenly spaced sample of rows has unit (or zero) L2 norm."""
+        if len(matrix) == 0:
+            return True
+        rows = np.linspace(0, len(matrix) - 1, min(len(matrix), sample_size)).astype(np.intp)
+        norms = np.linalg.norm(matrix[rows], axis=1)
+        return bool(np.all(np.isclose(norms, 1.0, atol=1e-3) | (norms == 0)))
+    
+    def _append_embeddings(self, vectors):
+        """Append one or more embeddings, doubling the matrix capacity when full.
+        
+        A read-only (memory-mapped) matrix is copied into memory on the first append.
+        """
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.embedding_dim))
+        needed = self._size + len(vectors)
+        if needed > len(self._emb) or not self._emb.flags.writeable:
+            grown = np.empty((max(needed, 2 * len(self._emb), 64), self.embedding_dim), dtype=np.float32)
+            grown[:self._size] = self._emb[:self._size]
+            self._emb = grown
+        self._emb[self._size:needed] = vectors
+        self._size = needed
+    
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """L2-normalize a vector or each row of a matrix (zero vectors are left as-is)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+    
     def _chunk_text(self, text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
-        """Split text into chunks with overlap."""
-        words = text.split()
+        """Split text into chunks of `chunk_size` words, with `overlap` words shared between neighbours.
+        
+        Chunks are sliced straight out of the original text using word offsets,
+        rather than re-joining word lists.
+        """
+        spans = [m.span() for m in _WORD_RE.finditer(text)]
+        step = max(1, chunk_size - overlap)
         chunks = []
         
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
+        for i in range(0, len(spans), step):
+            last = min(i + chunk_size, len(spans)) - 1
+            chunks.append(text[spans[i][0]:spans[last][1]])
         
         return chunks if chunks else [text]
     
@@ -305,31 +743,80 @@ class KnowledgeBase:
         """Clear all documents from the knowledge base."""
         self.documents = []
         self.metadatas = []
-        self.embeddings = []
-        self._save_index()
+        self._set_embeddings([])
+        self._inverted_index = {}
+        self._filter_index = None
+        self._embed_cache_used = set()
+        self._dirty = True
+        self.flush()
         logger.info("Knowledge base cleared")
     
+    def prune_embed_cache(self) -> int:
+        """Delete embed cache files not used by any document in the index.
+        
+        Only possible after the index was built from scratch (a new knowledge
+        base, or after clear()), since only then are all files in use known.
+        Returns the number of files removed.
+        """
+        if not self.embed_cache_dir or not os.path.isdir(self.embed_cache_dir):
+            return 0
+        if self._embed_cache_used is None:
+            logger.info("Index was loaded from disk; rebuild it before pruning the embed cache")
+            return 0
+        
+        removed = 0
+        with os.scandir(self.embed_cache_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith('.npy') and entry.name not in self._embed_cache_used:
+                    try:
+                        os.remove(entry.path)
+                        removed += 1
+                    except OSError as e:
+                        logger.warning(f"Could not remove embed cache file {entry.name}: {e}")
+        logger.info(f"Pruned {removed} unused embed cache files")
+        return removed
+    
+    def flush(self):
+        """Write the index to disk if it has unsaved changes."""
+        if self._dirty:
+            self._save_index()
+    
     def _save_index(self):
         """Save embeddings and metadata to disk using JSON and numpy (safer than pickle)."""
+        # Callers may have edited self.metadatas in place before saving
+        self._filter_index = None
         try:
             os.makedirs(self.knowledge_base_path, exist_ok=True)
             
-            # Save metadata as JSON (safe)
+            # Save metadata as compact JSON (safe); no indentation, since the
+            # file holds the full text of every chunk
             metadata_path = os.path.join(self.knowledge_base_path, "metadata.json")
             with open(metadata_path, 'w', encoding='utf-8') as f:
-                import json
                 json.dump({
                     'documents': self.documents,
                     'metadatas': self.metadatas
-                }, f, ensure_ascii=False, indent=2)
+                }, f, ensure_ascii=False, separators=(',', ':'))
             
             # Save embeddings as numpy array (safer than pickle)
+            # Written to a temporary file and swapped in, since the current
+            # embeddings may be memory-mapped from embeddings.npy itself
             embeddings_path = os.path.join(self.knowledge_base_path, "embeddings.npy")
-            np.save(embeddings_path, np.array(self.embeddings))
+            tmp_path = embeddings_path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, self.embeddings)
+            # A file that is still mapped can't be replaced on Windows, so move
+            # the rows into memory and drop the mapping first
+            if isinstance(self._emb, np.memmap):
+                self._emb = np.array(self._emb[:self._size])
+            os.replace(tmp_path, embeddings_path)
+            self._dirty = False
             
             logger.info("Index saved successfully (JSON + numpy)")
         except Exception as e:
             logger.error(f"Error saving index: {e}")
+            tmp_path = os.path.join(self.knowledge_base_path, "embeddings.npy.tmp")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
     
     def _load_index(self):
         """Load embeddings and metadata from disk (JSON + numpy format)."""
@@ -339,13 +826,14 @@ class KnowledgeBase:
         # Try new format first (JSON + numpy)
         if os.path.exists(metadata_path) and os.path.exists(embeddings_path):
             try:
-                import json
                 with open(metadata_path, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     self.documents = data['documents']
                     self.metadatas = data['metadatas']
                 
-                self.embeddings = list(np.load(embeddings_path, allow_pickle=False))
+                self._load_embeddings(embeddings_path)
+                self._index_tokens(self.documents)
+                self._filter_index = None
                 logger.info(f"Loaded index with {len(self.documents)} documents (JSON + numpy)")
                 return
             except Exception as e:
@@ -359,7 +847,9 @@ class KnowledgeBase:
                     data = pickle.load(f)
                     self.documents = data['documents']
                     self.metadatas = data['metadatas']
-                    self.embeddings = data['embeddings']
+                    self._set_embeddings(data['embeddings'])
+                self._index_tokens(self.documents)
+                self._filter_index = None
                 logger.warning(f"Loaded old pickle format. Converting to JSON + numpy...")
                 # Immediately save in new format
                 self._save_index()
@@ -370,8 +860,82 @@ class KnowledgeBase:
                 logger.error(f"Error loading pickle index: {e}")
                 self.documents = []
                 self.metadatas = []
-                self.embeddings = []
+                self._set_embeddings([])
         else:
             self.documents = []
             self.metadatas = []
-            self.embeddings = []
\ No newline at end of file
+            self._set_embeddings([])
+
+
+class QueryBatcher:
+    """Coalesces concurrent KnowledgeBase searches into batched query embedding.
+    
+    Each Slack event runs on its own worker thread; instead of every thread
+    calling the embedding model on its own, queries are queued and a single
+    background thread embeds whatever arrived within a short window in one
+    forward pass. Ranking then runs on the caller's thread.
+    """
+    
+    def __init__(
+        self,
+        kb: KnowledgeBase,
+        max_batch: int = QUERY_BATCH_MAX,
+        window: float = QUERY_BATCH_WINDOW_SEC,
+        timeout: float = QUERY_BATCH_TIMEOUT_SEC
+    ):
+        self.kb = kb
+        self.max_batch = max_batch
+        self.window = window
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="kb-query-batcher", daemon=True)
+        self._worker.start()
+    
+    def search(self, query: str, n_results: int = 3, collection_name: str = None, category: str = None) -> List[Dict]:
+        """Same as KnowledgeBase.search, with the query embedded in a shared batch.
+        
+        If the batch embedding fails, or doesn't arrive within `timeout`
+        seconds, the query is searched directly instead.
+        """
+        if len(self.kb.documents) == 0:
+            return []
+        
+        query_embedding = None
+        if self._worker.is_alive():
+            future = Future()
+            self._queue.put((query, future))
+            try:
+                query_embedding = future.result(timeout=self.timeout)
+            except Exception as e:
+                logger.warning(f"Batched query embedding unavailable, searching directly: {e!r}")
+        return self.kb.search(
+            query,
+            n_results=n_results,
+            collection_name=collection_name,
+            category=category,
+            query_embedding=query_embedding
+        )
+    
+    def _run(self):
+        """Background loop: gather a batch of queries and embed them together.
+        
+        Errors fail the batch's futures, never the loop itself.
+        """
+        while True:
+            batch = [self._queue.get()]
+            try:
+                deadline = time.monotonic() + self.window
+                try:
+                    while len(batch) < self.max_batch:
+                        batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    pass
+                
+                embeddings = self.kb.encode_queries([query for query, _ in batch])
+                for (_, future), embedding in zip(batch, embeddings):
+                    future.set_result(embedding)
+            except Exception as e:
+                logger.error(f"Error embedding query batch: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
@@ -1,23 +1,154 @@
 import ollama
+import httpx
 import logging
 import os
 import re
-from typing import List, Dict, Optional
+import json
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from cachetools import LRUCache, TTLCache
+from typing import List, Dict, Iterator, Optional
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Sampling options for chat requests
+CHAT_OPTIONS = {
+    'temperature': 0.3,  # Moderate temperature for natural but factual responses
+    'top_p': 0.9,
+    'repeat_penalty': 1.1
+}
+
+# System prompt that allows mixing KB and general knowledge. It is the same
+# for every request, so the prompt prefix stays byte-identical between turns.
+_SYSTEM_PROMPT = (
+    "You are a helpful assistant with access to a knowledge base and general knowledge.\n"
+    "INSTRUCTIONS:\n"
+    "- Prioritize information from the knowledge base when available\n"
+    "- You MAY supplement KB information with your general knowledge to provide complete, helpful answers\n"
+    "- For information from the KB, cite the source in square brackets like [Source: EMP_PM.pdf]\n"
+    "- For general knowledge, you don't need to cite, but be clear when you're adding context beyond the KB\n"
+    "- Be direct and concise\n"
+    "- If the KB has partial information, use it and fill in gaps with general knowledge\n"
+    "- If the KB has no information, provide a helpful answer from general knowledge\n"
+)
+_SYSTEM_MSG = {'role': 'system', 'content': _SYSTEM_PROMPT}
+
+# Static parts of the knowledge base message built by LlamaAI._format_kb_block
+NO_CONTEXT_NOTE = """No relevant context was found in the knowledge base.
+
+Please provide a helpful answer using your general knowledge."""
+_NO_CONTEXT_MSG = {'role': 'system', 'content': NO_CONTEXT_NOTE}
+
+KB_CONTEXT_HEADER = "=== KNOWLEDGE BASE CONTEXT ===\n\n"
+KB_CONTEXT_FOOTER = "=== END OF CONTEXT ===\n\n"
+
+KB_INSTRUCTIONS = """
+
+IMPORTANT INSTRUCTIONS:
+1. ONLY use information from the knowledge base above
+2. Do NOT use general knowledge, do NOT supplement with outside information
+3. Always cite the source document like [Source: FILENAME] when referencing KB content
+4. If you cannot find the answer in the knowledge base, respond: "I don't have information about this in the available documentation."
+5. Be direct and concise"""
+
+# str.translate table deleting control characters (C0, DEL and C1) from user input
+_CONTROL_CHARS = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0)], None)
+# The same characters as bytes, for the faster bytes.translate path on ASCII input
+_CONTROL_BYTES = bytes([*range(0x00, 0x20), 0x7f])
+
+# File paths in error messages, removed before the error is classified
+_PATH_RE = re.compile(r'/[^\s]+')
+
+# Conversation history kept per user, and how much of it goes into each prompt
+HISTORY_MAX_MESSAGES = 10  # 5 exchanges
+HISTORY_PROMPT_MESSAGES = 6  # Last 3 exchanges
+# Idle time after which a user's history expires when it is stored in Redis
+HISTORY_TTL_SEC = 24 * 60 * 60
+
+# Default number of cached answers kept by LlamaAI (0 disables the cache)
+RESPONSE_CACHE_SIZE = 512
+
+# Minimum time between two warmup requests
+WARMUP_INTERVAL_SEC = 60
+
+# Number of formatted knowledge base blocks kept for reuse
+KB_BLOCK_CACHE_SIZE = 256
+
+# Default number of idle keep-alive connections to Ollama kept for reuse
+OLLAMA_POOL_SIZE = 8
+
 
 class LlamaAI:
     """Handles interactions with Llama AI through Ollama."""
     
-    def __init__(self, model: str = "llama3.2:3b", base_url: str = "http://localhost:11434"):
+    def __init__(
+        self,
+        model: str = "llama3.2:3b",
+        base_url: str = "http://localhost:11434",
+        response_cache_size: int = RESPONSE_CACHE_SIZE,
+        response_cache_ttl: Optional[float] = None,
+        redis_url: Optional[str] = None,
+        pool_size: int = OLLAMA_POOL_SIZE,
+        warmup_keep_alive: Optional[str] = None
+    ):
         self.model = model
         self.base_url = base_url
-        self.conversation_history = {}
+        self.conversation_history: Dict[str, deque] = {}
+        
+        # Optional Redis store shared by all bot processes; history stays in
+        # self.conversation_history when it is not configured or unreachable
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url, decode_responses=True)
+                self._redis.ping()
+                logger.info("Storing conversation history in Redis")
+            except Exception as e:
+                logger.warning(f"Redis unavailable, keeping conversation history in memory: {e}")
+                self._redis = None
+        
+        # Answers to repeated questions over the same KB chunks, keyed by _response_key.
+        # Entries expire after response_cache_ttl seconds when a TTL is given.
+        if response_cache_size <= 0:
+            self._response_cache = None
+        elif response_cache_ttl:
+            self._response_cache = TTLCache(maxsize=response_cache_size, ttl=response_cache_ttl)
+        else:
+            self._response_cache = LRUCache(maxsize=response_cache_size)
+        self._response_cache_lock = threading.Lock()
+        
+        # Formatted KB blocks, keyed by the (source, content) of their chunks; the
+        # same search results come back for popular questions, and their strings
+        # cache their hashes, so a hit skips re-joining several KB of context
+        self._kb_block_cache = LRUCache(maxsize=KB_BLOCK_CACHE_SIZE)
+        self._kb_block_cache_lock = threading.Lock()
+        # How long Ollama keeps the model loaded after a warmup; None leaves it
+        # to the server's OLLAMA_KEEP_ALIVE
+        self.warmup_keep_alive = warmup_keep_alive
+        self._last_warmup = 0.0
+        self._warmup_lock = threading.Lock()
         
-        # Create client with custom base_url (FIX: actually use the parameter)
-        self.client = ollama.Client(host=base_url)
+        self.pool_size = pool_size
+        
+        # Create client with custom base_url (FIX: actually use the parameter).
+        # All requests share one pool that keeps up to pool_size idle connections
+        # alive for reuse; the number of open connections isn't capped, since a
+        # streamed answer holds its connection for the whole generation and the
+        # client has no timeout for waiting on a free one. Connect errors are
+        # retried once.
+        self.client = ollama.Client(
+            host=base_url,
+            transport=httpx.HTTPTransport(
+                limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool_size),
+                retries=1
+            )
+        )
         
         # Test connection
         try:
@@ -32,20 +163,22 @@ class LlamaAI:
         """Sanitize user input to prevent log injection and other issues."""
         if not text:
             return ""
-        # Remove control characters and limit length
-        sanitized = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-        return sanitized[:10000]  # Max 10k chars
+        # Limit length first (max 10k chars), so long pastes aren't scanned in full,
+        # then remove control characters
+        text = text[:10000]
+        if text.isascii():
+            return text.encode('ascii').translate(None, _CONTROL_BYTES).decode('ascii')
+        return text.translate(_CONTROL_CHARS)
     
     @staticmethod
     def _sanitize_error(error: Exception) -> str:
         """Sanitize error messages to not leak internals."""
-        error_str = str(error)
-        # Remove file paths
-        error_str = re.sub(r'/[^\s]+', '[path]', error_str)
+        # Remove file paths, so e.g. /srv/connection_pool.py isn't taken for a connection error
+        error_str = _PATH_RE.sub('[path]', str(error)).lower()
         # Generic message for common errors
-        if 'connection' in error_str.lower():
+        if 'connection' in error_str:
             return "Unable to connect to the AI service"
-        if 'timeout' in error_str.lower():
+        if 'timeout' in error_str:
             return "Request timed out"
         return "An error occurred while processing your request"
     
@@ -63,130 +196,303 @@ class LlamaAI:
         if not query:
             return "I didn't receive a valid question."
         
-        # Build the prompt with context
-        prompt = self._build_prompt(query, context)
-
-        # Get conversation history for this user
-        messages = []
-
-        # Add system message that allows mixing KB and general knowledge
-        system_content = (
-            "You are a helpful assistant with access to a knowledge base and general knowledge.\n"
-            "INSTRUCTIONS:\n"
-            "- Prioritize information from the knowledge base when available\n"
-            "- You MAY supplement KB information with your general knowledge to provide complete, helpful answers\n"
-            "- For information from the KB, cite the source in square brackets like [Source: EMP_PM.pdf]\n"
-            "- For general knowledge, you don't need to cite, but be clear when you're adding context beyond the KB\n"
-            "- Be direct and concise\n"
-            "- If the KB has partial information, use it and fill in gaps with general knowledge\n"
-            "- If the KB has no information, provide a helpful answer from general knowledge\n"
-        )
-
-        messages.append({'role': 'system', 'content': system_content})
-        
-        if use_history and user_id and user_id in self.conversation_history:
-            messages.extend(self.conversation_history[user_id][-6:])  # Last 3 exchanges
+        # Read the history once; it decides cacheability and goes into the prompt
+        history = self._recent_history(user_id) if use_history and user_id else []
+        cache_key = self._response_key(query, context, history)
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            self._store_history(user_id, query, cached)
+            return cached
         
-        # Add current query
-        messages.append({
-            'role': 'user',
-            'content': prompt
-        })
+        messages = self._build_messages(query, context, history)
         
         try:
             # Generate response with moderate temperature for natural answers
             response = self.client.chat(
                 model=self.model,
                 messages=messages,
-                options={
-                    'temperature': 0.3,  # Moderate temperature for natural but factual responses
-                    'top_p': 0.9,
-                    'repeat_penalty': 1.1
-                }
+                options=CHAT_OPTIONS
             )
             
             assistant_message = response['message']['content']
-            
-            # Store in conversation history
-            if user_id:
-                if user_id not in self.conversation_history:
-                    self.conversation_history[user_id] = []
-                
-                self.conversation_history[user_id].append({
-                    'role': 'user',
-                    'content': query  # Store original query, not the full prompt
-                })
-                self.conversation_history[user_id].append({
-                    'role': 'assistant',
-                    'content': assistant_message
-                })
-                
-                # Keep only last 10 messages (5 exchanges)
-                if len(self.conversation_history[user_id]) > 10:
-                    self.conversation_history[user_id] = self.conversation_history[user_id][-10:]
-            
+            self._cache_response(cache_key, assistant_message)
+            self._store_history(user_id, query, assistant_message)
             return assistant_message
             
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             return self._sanitize_error(e)
     
-    def _build_prompt(self, query: str, context: List[Dict] = None) -> str:
-        """Build a prompt with context from knowledge base."""
+    def generate_responses(
+        self,
+        queries: List[str],
+        contexts: List[List[Dict]] = None
+    ) -> List[str]:
+        """Answer several independent questions at once, without conversation history.
+        
+        Ollama's chat API takes one conversation per request, so the requests
+        are sent concurrently (up to pool_size at a time); the server batches
+        them when OLLAMA_NUM_PARALLEL allows. Answers are returned in order.
+        """
+        if not queries:
+            return []
+        contexts = contexts or [None] * len(queries)
+        with ThreadPoolExecutor(max_workers=min(len(queries), self.pool_size)) as pool:
+            return list(pool.map(
+                lambda query, context: self.generate_response(query, context, use_history=False),
+                queries, contexts
+            ))
+    
+    def stream_response(
+        self, 
+        query: str, 
+        context: List[Dict] = None,
+        user_id: str = None,
+        use_history: bool = True
+    ) -> Iterator[str]:
+        """Stream a response from Llama, yielding text fragments as they are generated.
+        
+        Same prompt and history handling as generate_response; the full answer is
+        stored in the conversation history once the stream completes.
+        """
+        
+        # Sanitize input
+        query = self._sanitize_input(query)
+        if not query:
+            yield "I didn't receive a valid question."
+            return
+        
+        # Read the history once; it decides cacheability and goes into the prompt
+        history = self._recent_history(user_id) if use_history and user_id else []
+        cache_key = self._response_key(query, context, history)
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            self._store_history(user_id, query, cached)
+            yield cached
+            return
+        
+        messages = self._build_messages(query, context, history)
+        
+        parts = []
+        try:
+            for chunk in self.client.chat(
+                model=self.model,
+                messages=messages,
+                options=CHAT_OPTIONS,
+                stream=True
+            ):
+                piece = chunk['message']['content']
+                if piece:
+                    parts.append(piece)
+                    yield piece
+        except Exception as e:
+            logger.error(f"Error streaming response: {e}")
+            yield ("\n\n" if parts else "") + self._sanitize_error(e)
+            return
+        
+        assistant_message = "".join(parts)
+        self._cache_response(cache_key, assistant_message)
+        self._store_history(user_id, query, assistant_message)
+    
+    def _response_key(
+        self,
+        query: str,
+        context: List[Dict] = None,
+        history: List[Dict] = None
+    ) -> Optional[str]:
+        """Cache key for a question over the given KB chunks, or None if it can't be cached.
+        
+        Answers that depend on conversation history are never cached, so only
+        history-free requests (use_history=False or no prior turns) get a key.
+        """
+        if self._response_cache is None or history:
+            return None
+        
+        # The source is quoted in the prompt, so it is part of each chunk's hash
+        chunk_hashes = sorted(
+            hashlib.blake2b(
+                (ctx.get('metadata', {}).get('source', 'Unknown') + "\0" + ctx.get('content', '')).encode('utf-8')
+            ).hexdigest()
+            for ctx in context or []
+        )
+        key_text = query + "|" + "|".join(chunk_hashes)
+        return hashlib.blake2b(key_text.encode('utf-8')).hexdigest()
+    
+    def _get_cached_response(self, key: Optional[str]) -> Optional[str]:
+        """Return the cached answer for key, if any."""
+        if key is None:
+            return None
+        with self._response_cache_lock:
+            return self._response_cache.get(key)
+    
+    def _cache_response(self, key: Optional[str], answer: str):
+        """Remember a successful answer under key."""
+        if key is None or not answer:
+            return
+        with self._response_cache_lock:
+            self._response_cache[key] = answer
+    
+    def _build_messages(
+        self, 
+        query: str, 
+        context: List[Dict] = None,
+        history: List[Dict] = None
+    ) -> List[Dict]:
+        """Build the chat messages for a question.
+        
+        Layout: static system prompt -> conversation history -> knowledge base
+        context (as its own system message) -> current question. Everything
+        before the KB block is identical from one turn to the next, so Ollama
+        can reuse its prompt cache for that prefix.
+        """
+        # Static system prompt (shared, never mutated)
+        messages = [_SYSTEM_MSG]
+        
+        # Recent conversation history for this user (from _recent_history)
+        if history:
+            messages.extend(history)
+        
+        # Add the per-question knowledge base context (a shared static message
+        # when there is none), then the question itself
+        if context:
+            messages.append({'role': 'system', 'content': self._format_kb_block(context)})
+        else:
+            messages.append(_NO_CONTEXT_MSG)
+        messages.append({'role': 'user', 'content': query})
+        
+        return messages
+    
+    @staticmethod
+    def _history_key(user_id: str) -> str:
+        """Redis key of a user's conversation history."""
+        return f"hist:{user_id}"
+    
+    def _recent_history(self, user_id: str) -> List[Dict]:
+        """The last HISTORY_PROMPT_MESSAGES messages of a user's conversation."""
+        if self._redis is not None:
+            try:
+                stored = self._redis.lrange(self._history_key(user_id), -HISTORY_PROMPT_MESSAGES, -1)
+                return [json.loads(message) for message in stored]
+            except Exception as e:
+                logger.error(f"Error reading history from Redis: {e}")
+                return []
+        
+        history = self.conversation_history.get(user_id)
+        if not history:
+            return []
+        return list(islice(history, max(0, len(history) - HISTORY_PROMPT_MESSAGES), None))
+    
+    def _store_history(self, user_id: Optional[str], query: str, assistant_message: str):
+        """Record a completed exchange in the user's conversation history."""
+        if not user_id:
+            return
+        
+        exchange = [
+            {'role': 'user', 'content': query},  # Store original query, not the full prompt
+            {'role': 'assistant', 'content': assistant_message}
+        ]
+        
+        if self._redis is not None:
+            # Append and trim in one round-trip; the window is kept server-side
+            key = self._history_key(user_id)
+            try:
+                pipe = self._redis.pipeline()
+                pipe.rpush(key, *(json.dumps(message) for message in exchange))
+                pipe.ltrim(key, -HISTORY_MAX_MESSAGES, -1)
+                pipe.expire(key, HISTORY_TTL_SEC)
+                pipe.execute()
+            except Exception as e:
+                logger.error(f"Error storing history in Redis: {e}")
+            return
+        
+        # Bounded to the last 10 messages (5 exchanges); older ones drop off in O(1)
+        if user_id not in self.conversation_history:
+            self.conversation_history[user_id] = deque(maxlen=HISTORY_MAX_MESSAGES)
+        self.conversation_history[user_id].extend(exchange)
+    
+    def _format_kb_block(self, context: List[Dict] = None) -> str:
+        """Format knowledge base context (and answering instructions) for the prompt."""
         
         if not context or len(context) == 0:
-            return f"""No relevant context was found in the knowledge base.
-
-Question: {query}
-
-Please provide a helpful answer using your general knowledge."""
+            return NO_CONTEXT_NOTE
         
-        # Build context string with clear separation
-        context_str = "=== KNOWLEDGE BASE CONTEXT ===\n\n"
-        for i, ctx in enumerate(context, 1):
-            source = ctx.get('metadata', {}).get('source', 'Unknown')
-            content = ctx.get('content', '')
-            context_str += f"--- Document {i} (Source: {source}) ---\n{content}\n\n"
+        docs = tuple(
+            (ctx.get('metadata', {}).get('source', 'Unknown'), ctx.get('content', ''))
+            for ctx in context
+        )
+        with self._kb_block_cache_lock:
+            block = self._kb_block_cache.get(docs)
+        if block is not None:
+            return block
         
-        context_str += "=== END OF CONTEXT ===\n\n"
+        # Build context string with clear separation
+        parts = [KB_CONTEXT_HEADER]
+        for i, (source, content) in enumerate(docs, 1):
+            parts.append(f"--- Document {i} (Source: {source}) ---\n{content}\n\n")
         
-        # Build prompt that enforces KB-ONLY answers
-        prompt = f"""{context_str}
-
-IMPORTANT INSTRUCTIONS:
-1. ONLY use information from the knowledge base above
-2. Do NOT use general knowledge, do NOT supplement with outside information
-3. Always cite the source document like [Source: FILENAME] when referencing KB content
-4. If you cannot find the answer in the knowledge base, respond: "I don't have information about this in the available documentation."
-5. Be direct and concise
-
-Question: {query}
-
-Answer:"""
+        # Close the context and append the instructions that enforce KB-ONLY answers
+        parts.append(KB_CONTEXT_FOOTER)
+        parts.append(KB_INSTRUCTIONS)
         
-        return prompt
+        block = "".join(parts)
+        with self._kb_block_cache_lock:
+            self._kb_block_cache[docs] = block
+        return block
     
     def clear_history(self, user_id: str = None):
         """Clear conversation history for a user or all users."""
+        if self._redis is not None:
+            try:
+                if user_id:
+                    self._redis.delete(self._history_key(user_id))
+                else:
+                    keys = list(self._redis.scan_iter(match=self._history_key("*")))
+                    if keys:
+                        self._redis.delete(*keys)
+            except Exception as e:
+                logger.error(f"Error clearing history in Redis: {e}")
+        
         if user_id:
             if user_id in self.conversation_history:
                 del self.conversation_history[user_id]
-                logger.info(f"Cleared history for user {user_id}")
+            logger.info(f"Cleared history for user {user_id}")
         else:
             self.conversation_history = {}
             logger.info("Cleared all conversation history")
     
+    def warmup(self):
+        """Make sure the model is loaded in Ollama before a prompt is sent.
+        
+        Meant to run while the knowledge base search is in progress, so the
+        model load doesn't add to the time to first token. An empty prompt
+        only loads the model; calls within WARMUP_INTERVAL_SEC are skipped.
+        """
+        with self._warmup_lock:
+            now = time.monotonic()
+            if now - self._last_warmup < WARMUP_INTERVAL_SEC:
+                return
+            self._last_warmup = now
+        kwargs = {'keep_alive': self.warmup_keep_alive} if self.warmup_keep_alive else {}
+        try:
+            self.client.generate(model=self.model, prompt='', **kwargs)
+        except Exception as e:
+            logger.warning(f"Model warmup failed: {self._sanitize_error(e)}")
+    
     def check_model_availability(self) -> bool:
         """Check if the specified model is available."""
         try:
             models = self.client.list()
-            available_models = [model['name'] for model in models.get('models', [])]
+            # Newer ollama clients report the name under 'model', older ones under 'name'
+            available_models = {
+                model.get('model') or model.get('name') for model in models.get('models', [])
+            }
             
-            # Check if our model is in the list
-            model_available = any(self.model in model for model in available_models)
+            # Exact match; an untagged model name refers to its ':latest' tag
+            target = self.model if ':' in self.model else f"{self.model}:latest"
+            model_available = target in available_models or self.model in available_models
             
             if not model_available:
-                logger.warning(f"Model {self.model} not found. Available models: {available_models}")
+                logger.warning(f"Model {self.model} not found. Available models: {sorted(filter(None, available_models))}")
                 logger.info(f"To download the model, run: ollama pull {self.model}")
             else:
                 logger.info(f"Model {self.model} is available")
@@ -0,0 +1,35 @@
+"""Shared setup for the knowledge base maintenance scripts."""
+import functools
+import os
+import sys
+
+# ensure project root is on sys.path so imports work when run as a script
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from knowledge_base_manager import KnowledgeBase
+
+KB_PATH = 'knowledge_base'
+
+
+def build_kb(path: str = KB_PATH, chunk_size: int = None, overlap: int = 50,
+             collection: str = None, kb: KnowledgeBase = None) -> KnowledgeBase:
+    """Rebuild a knowledge base from scratch from `path` (or its `collection` subfolder).
+    
+    Reuses `kb` when given instead of loading the index a second time. With
+    `chunk_size`, documents are split with a custom chunk size and overlap
+    instead of the KnowledgeBase default. A full rebuild (no `collection`)
+    also prunes embed cache files that no document uses anymore.
+    """
+    if kb is None:
+        kb = KnowledgeBase(knowledge_base_path=path, embed_cache_dir=os.path.join(path, ".embed_cache"))
+    
+    if chunk_size is not None:
+        # The KnowledgeBase chunker slices chunks straight out of the text by word offsets
+        kb._chunk_text = functools.partial(kb._chunk_text, chunk_size=chunk_size, overlap=overlap)
+    
+    kb.clear()
+    folder = os.path.join(path, collection) if collection else path
+    kb.load_documents_from_folder(folder, collection_name=collection)
+    if collection is None:
+        kb.prune_embed_cache()
+    return kb
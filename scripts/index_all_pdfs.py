@@ -1,35 +1,65 @@
 #!/usr/bin/env python3
-import sys
 import os
-# ensure project root is on sys.path so imports work when run as a script
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from knowledge_base_manager import KnowledgeBase
 
-KB_PATH = 'knowledge_base'
-kb = KnowledgeBase(knowledge_base_path=KB_PATH)
-processed_folders = 0
-for root, dirs, files in os.walk(KB_PATH):
-    pdfs = [f for f in files if f.lower().endswith('.pdf')]
-    if not pdfs:
-        continue
-    rel = os.path.relpath(root, KB_PATH)
-    collection = rel if rel != '.' else None
-    print(f'Processing folder: {root} -> collection: {collection}')
-    kb.load_documents_from_folder(root, collection_name=collection)
-    processed_folders += 1
+from _common import KB_PATH, KnowledgeBase
 
-print('\nFinished. Processed folders:', processed_folders)
-print('KB stats:', kb.get_stats())
 
-# Sample verification query against 'springworks' if present
-query = "How do I verify a candidate's employment and references?"
-col = 'springworks'
-if os.path.isdir(os.path.join(KB_PATH, col)):
-    ctx = kb.search(query, n_results=5, collection_name=col)
-    print('\nTop matches for collection springworks:')
-    for i,c in enumerate(ctx,1):
-        print(f"{i}) {c.get('metadata',{}).get('source')} - distance={c.get('distance')}")
-        print(c.get('content')[:300].replace('\n',' '))
-        print('---')
-else:
-    print('\nNo springworks collection found; skipping sample query.')
+def iter_pdfs(root):
+    """Yield the paths of all PDFs under root (DirEntry type info avoids a stat per file)."""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_pdfs(entry.path)
+            elif entry.name.lower().endswith('.pdf'):
+                yield entry.path
+
+
+if __name__ == '__main__':
+    kb = KnowledgeBase(knowledge_base_path=KB_PATH, embed_cache_dir=os.path.join(KB_PATH, ".embed_cache"))
+    
+    # Group PDFs by folder; each subfolder of KB_PATH is a collection
+    pdfs_by_folder = {}
+    for path in iter_pdfs(KB_PATH):
+        pdfs_by_folder.setdefault(os.path.dirname(path), []).append(path)
+    
+    pdf_paths = []
+    collections = []
+    folder_collections = {}
+    for root, paths in pdfs_by_folder.items():
+        rel = os.path.relpath(root, KB_PATH)
+        collection = rel if rel != '.' else None
+        print(f'Processing folder: {root} -> collection: {collection}')
+        pdf_paths.extend(paths)
+        collections.extend([collection] * len(paths))
+        folder_collections[root] = collection
+    processed_folders = len(pdfs_by_folder)
+    
+    # Skip if KB already loaded to avoid re-indexing (same rule as load_documents_from_folder)
+    if kb.documents:
+        print(f'Knowledge base already loaded with {len(kb.documents)} documents, skipping re-index')
+    else:
+        # Extract all PDFs in parallel worker processes, then embed them in one batch
+        kb.add_pdfs(pdf_paths, collections)
+        
+        # The .docx and .txt files next to those PDFs, saved together at the end
+        for root, collection in folder_collections.items():
+            kb.load_documents_from_folder(root, collection_name=collection,
+                                          extensions={'.docx', '.txt'}, bulk=True)
+        kb.flush()
+        kb.prune_embed_cache()
+    
+    print('\nFinished. Processed folders:', processed_folders)
+    print('KB stats:', kb.get_stats())
+
+    # Sample verification query against 'springworks' if present
+    query = "How do I verify a candidate's employment and references?"
+    col = 'springworks'
+    if os.path.isdir(os.path.join(KB_PATH, col)):
+        ctx = kb.search(query, n_results=5, collection_name=col)
+        print('\nTop matches for collection springworks:')
+        for i,c in enumerate(ctx,1):
+            print(f"{i}) {c.get('metadata',{}).get('source')} - distance={c.get('distance')}")
+            print(c.get('content')[:300].replace('\n',' '))
+            print('---')
+    else:
+        print('\nNo springworks collection found; skipping sample query.')
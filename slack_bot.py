@@ -1,9 +1,15 @@
 import os
 import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
-from knowledge_base_manager import KnowledgeBase
+from slack_sdk.errors import SlackApiError
+from knowledge_base_manager import KnowledgeBase, QueryBatcher
 from llama_ai import LlamaAI
 import logging
 
@@ -21,58 +27,182 @@ load_dotenv()
 FORCE_KB_COLLECTION = os.environ.get("FORCE_KB_COLLECTION")
 # Default collection to use when no specific intent is detected
 DEFAULT_COLLECTION = os.environ.get("DEFAULT_KB_COLLECTION", "springworks")
-
-# Category-specific keywords for intelligent routing
-EMPLOYMENT_KEYWORDS = [
+# Stream answers into Slack as they are generated (set to "false" to post complete answers)
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "true").lower() != "false"
+# While streaming, the Slack message is updated at most this often (or every N fragments);
+# chat.update is a Tier 3 method (about 50 calls per minute per workspace)
+STREAM_UPDATE_INTERVAL_SEC = 1.5
+STREAM_UPDATE_FRAGMENTS = 60
+# Wait used when a rate-limited Slack response has no Retry-After header
+SLACK_RETRY_AFTER_SEC = 1.0
+# How long to wait for the "Searching..." placeholder before posting the answer separately
+PLACEHOLDER_TIMEOUT_SEC = 2
+
+# Slack events handled at the same time: Bolt runs each listener on a worker
+# thread, so searches and Ollama calls for different users overlap
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "10"))
+
+# Longest query text embedded for a KB search; the full message still goes to the LLM
+MAX_SEARCH_CHARS = 1024
+
+# Background calls that don't block the KB search (placeholder posts, model warmup)
+EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="slack-post")
+
+# Category-specific keywords for intelligent routing (lowercase, immutable)
+EMPLOYMENT_KEYWORDS = (
     'employment', 'employ', 'work', 'reference', 'candidate', 'hr', 'company',
     'last working', 'working date', 'designation', 'salary', 'relieving',
     'experience letter', 'joining date', 'tenure', 'employee', 'payslip',
     'employment contract', 'offer letter', 'overlap', 'concurrent', 'overlap check'
-]
+)
 
-EDUCATION_KEYWORDS = [
+EDUCATION_KEYWORDS = (
     'education', 'degree', 'university', 'college', 'certificate', 'school',
     'diploma', 'graduation', 'credential', 'academic', 'institution', 'course',
     'marks', 'transcript', 'major', 'minor', 'license', 'certification'
-]
+)
 
-ADDRESS_KEYWORDS = [
+ADDRESS_KEYWORDS = (
     'dav', 'pav', 'cav', 'address', 'digital address', 'present address', 
     'current address', 'permanent address', 'address verification', 'postal',
     'location', 'residence'
-]
+)
 
-CRIMINAL_KEYWORDS = [
+CRIMINAL_KEYWORDS = (
     'criminal', 'court', 'case', 'record', 'database', 'conviction',
     'arrest', 'prosecution', 'legal', 'jail', 'prison', 'offense', 'felony'
-]
+)
 
-IDENTITY_KEYWORDS = [
+IDENTITY_KEYWORDS = (
     'identity', 'id', 'aadhar', 'pan', 'passport', 'driving license',
     'government id', 'voter id', 'ssn', 'tax id', 'identification'
-]
+)
 
 # All verification keywords (for backward compatibility)
 VERIFICATION_KEYWORDS = (
     EMPLOYMENT_KEYWORDS + EDUCATION_KEYWORDS + ADDRESS_KEYWORDS + 
     CRIMINAL_KEYWORDS + IDENTITY_KEYWORDS + 
-    ['verification', 'verify', 'screening', 'checks', 'background',
+    ('verification', 'verify', 'screening', 'checks', 'background',
      'green', 'red', 'amber', 'discrepancy', 'mismatch', 'match',
-     'verified', 'unverified', 'pending', 'completed', 'insufficient']
+     'verified', 'unverified', 'pending', 'completed', 'insufficient')
+)
+
+# Keyword routing table, in the order categories are checked
+CATEGORY_KEYWORDS = (
+    ('employment', EMPLOYMENT_KEYWORDS),
+    ('education', EDUCATION_KEYWORDS),
+    ('address', ADDRESS_KEYWORDS),
+    ('criminal', CRIMINAL_KEYWORDS),
+    ('identity', IDENTITY_KEYWORDS),
 )
 
+# One compiled alternation per category, so each category is checked in a single
+# C-level scan of the message; longer keywords first so they win over their prefixes
+_CATEGORY_PATTERNS = {
+    name: re.compile('|'.join(re.escape(kw) for kw in sorted(keywords, key=len, reverse=True)))
+    for name, keywords in CATEGORY_KEYWORDS
+}
+
+# Greetings get a canned reply straight away, without a KB search or LLM call
+GREETING_RE = re.compile(
+    r'^\s*(hi|hello|hey|yo|good (morning|afternoon|evening))[\s!.?]*$', re.IGNORECASE
+)
+GREETING_REPLY = "Hi! Ask me anything about verification."
+
+# Messages that are not questions; ignored instead of running a KB search and LLM call
+_TRIVIAL = frozenset({'thanks', 'thank you', 'ty', 'ok', 'k', '👍'})
+_EMOJI_ONLY_RE = re.compile(r'^(?::[\w+-]+:\s*)+$')
+
+
+def is_trivial_message(text: str) -> bool:
+    """Return True for acknowledgements and emoji-only messages."""
+    return text.lower() in _TRIVIAL or bool(_EMOJI_ONLY_RE.match(text))
+
+
+# str.translate table deleting control characters (C0, DEL and C1) from user text before logging
+_LOG_STRIP = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0)], None)
+# The same characters as bytes, for the faster bytes.translate path on ASCII text
+_LOG_STRIP_BYTES = bytes([*range(0x00, 0x20), 0x7f])
+
+# Longest message excerpt written to the logs
+LOG_TEXT_MAX_CHARS = 200
+
+
+# Bot user id, resolved once via auth.test and reused for every mention
+_BOT_USER_ID = None
+
+
+def get_bot_user_id(client) -> str:
+    """Return the bot's user id, calling auth.test only the first time."""
+    global _BOT_USER_ID
+    if _BOT_USER_ID is None:
+        _BOT_USER_ID = client.auth_test()['user_id']
+    return _BOT_USER_ID
+
+
+@lru_cache(maxsize=None)
+def _mention_pattern(bot_user_id: str) -> re.Pattern:
+    """Compiled pattern matching mentions of the bot, with or without a |label."""
+    return re.compile(rf'<@{re.escape(bot_user_id)}(\|[^>]*)?>')
+
+
+def strip_bot_mention(text: str, bot_user_id: str) -> str:
+    """Remove mentions of the bot from a message.
+    
+    Plain `<@U…>` mentions are removed with str.replace; the regex is only
+    needed for the rarer labeled form `<@U…|name>`.
+    """
+    if '|' not in text:
+        return text.replace(f'<@{bot_user_id}>', '').strip()
+    return _mention_pattern(bot_user_id).sub('', text).strip()
+
 
 def sanitize_for_logging(text: str) -> str:
     """Sanitize user input before logging to prevent log injection."""
     if not text:
         return ""
+    # Limit length for logs first, so only the logged part is scanned
+    sanitized = text[:LOG_TEXT_MAX_CHARS]
     # Remove control characters and newlines
-    sanitized = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-    # Limit length for logs
-    return sanitized[:200] + "..." if len(sanitized) > 200 else sanitized
+    if sanitized.isascii():
+        sanitized = sanitized.encode('ascii').translate(None, _LOG_STRIP_BYTES).decode('ascii')
+    else:
+        sanitized = sanitized.translate(_LOG_STRIP)
+    return sanitized + "..." if len(text) > LOG_TEXT_MAX_CHARS else sanitized
+
+
+def keyword_counts(lowered: str) -> dict:
+    """Number of distinct keywords of each category found in lowercased text."""
+    return {name: len(set(pattern.findall(lowered))) for name, pattern in _CATEGORY_PATTERNS.items()}
+
+
+# Keyword categories in priority order, with the document category each maps to
+_CATEGORY_PRIORITY = (
+    ('employment', 'employment'),
+    ('education', 'education'),
+    ('address', 'address'),
+    ('criminal', 'compliance'),
+    ('identity', 'compliance'),
+)
 
 
-def detect_collection_for_query(text: str) -> str | None:
+def detect_category(counts: dict) -> str | None:
+    """Document category to filter on, from keyword_counts() of a query."""
+    for name, category in _CATEGORY_PRIORITY:
+        if counts[name]:
+            return category
+    return None
+
+
+def first_category(lowered: str) -> str | None:
+    """Same result as detect_category(), stopping at the first matching keyword pattern."""
+    for name, category in _CATEGORY_PRIORITY:
+        if _CATEGORY_PATTERNS[name].search(lowered):
+            return category
+    return None
+
+
+def detect_collection_for_query(text: str, counts: dict = None) -> str | None:
     """Intelligently detect the document category from query keywords.
     
     Routes to specific collections based on keywords:
@@ -88,23 +218,9 @@ def detect_collection_for_query(text: str) -> str | None:
     if not text:
         return DEFAULT_COLLECTION
 
-    lowered = text.lower()
-    
     # Count keyword matches per category
-    employment_count = sum(1 for kw in EMPLOYMENT_KEYWORDS if kw in lowered)
-    education_count = sum(1 for kw in EDUCATION_KEYWORDS if kw in lowered)
-    address_count = sum(1 for kw in ADDRESS_KEYWORDS if kw in lowered)
-    criminal_count = sum(1 for kw in CRIMINAL_KEYWORDS if kw in lowered)
-    identity_count = sum(1 for kw in IDENTITY_KEYWORDS if kw in lowered)
-    
-    # Determine dominant category
-    counts = {
-        'employment': employment_count,
-        'education': education_count,
-        'address': address_count,
-        'criminal': criminal_count,
-        'identity': identity_count
-    }
+    if counts is None:
+        counts = keyword_counts(text.lower())
     
     dominant = max(counts, key=counts.get)
     
@@ -117,8 +233,25 @@ def detect_collection_for_query(text: str) -> str | None:
     return DEFAULT_COLLECTION
 
 
-def build_response_blocks(response: str, context: list, user_id: str = None) -> list:
-    """Build Slack Block Kit response with optional source citations.
+def route(text: str) -> tuple:
+    """Collection and category to search for a query, from a single keyword scan.
+    
+    FORCE_KB_COLLECTION, when set, overrides the detected collection, and
+    only the category is looked up.
+    """
+    if FORCE_KB_COLLECTION:
+        return FORCE_KB_COLLECTION, first_category(text.lower())
+    counts = keyword_counts(text.lower())
+    return detect_collection_for_query(text, counts), detect_category(counts)
+
+
+def _unique_sources(context: list) -> list:
+    """Source names of the context documents, deduplicated in retrieval order."""
+    return list(dict.fromkeys(source for ctx in context if (source := ctx.get('source'))))
+
+
+def build_response_blocks(response: str, context: list, user_id: str = None) -> list | None:
+    """Build Slack Block Kit response with source citations.
     
     Args:
         response: The bot's response text
@@ -126,35 +259,33 @@ def build_response_blocks(response: str, context: list, user_id: str = None) ->
         user_id: Optional user ID to mention
     
     Returns:
-        List of Slack blocks
+        List of Slack blocks, or None when there are no sources to cite
+        (the response is then posted as plain mrkdwn text)
     """
-    blocks = [
+    # Add context indicator if knowledge base was used
+    sources = _unique_sources(context) if context else []
+    if not sources:
+        return None
+    
+    return [
         {
             "type": "section",
             "text": {
                 "type": "mrkdwn",
                 "text": f"<@{user_id}> {response}" if user_id else response
             }
+        },
+        {"type": "divider"},
+        {
+            "type": "context",
+            "elements": [
+                {
+                    "type": "mrkdwn",
+                    "text": f"📚 *Sources:* {', '.join(sources)}"
+                }
+            ]
         }
     ]
-    
-    # Add context indicator if knowledge base was used
-    if context and len(context) > 0:
-        sources = list(set([ctx.get('metadata', {}).get('source', 'Unknown') 
-                          for ctx in context if ctx.get('metadata', {}).get('source')]))
-        if sources:
-            blocks.append({"type": "divider"})
-            blocks.append({
-                "type": "context",
-                "elements": [
-                    {
-                        "type": "mrkdwn",
-                        "text": f"📚 *Sources:* {', '.join(sources)}"
-                    }
-                ]
-            })
-    
-    return blocks
 
 
 def build_error_blocks(user_id: str = None) -> list:
@@ -185,36 +316,177 @@ def build_error_blocks(user_id: str = None) -> list:
         }
     ]
 
+
+def stream_to_slack(client, channel_id: str, fragments, ts: str = None,
+                    thread_ts: str = None, prefix: str = "") -> tuple:
+    """Show a streamed answer in Slack while it is being generated.
+    
+    Updates the message `ts` (or posts a new one on the first fragment) with
+    the text so far, throttled to one Slack call per STREAM_UPDATE_INTERVAL_SEC
+    or STREAM_UPDATE_FRAGMENTS fragments. A failed update is skipped (after a
+    rate limit, until Slack's Retry-After has passed) and the stream is always
+    read to the end, so the answer still reaches the conversation history.
+    
+    Returns:
+        The full answer text and the ts of the message showing it
+    """
+    parts = []
+    pending = 0
+    last_update = 0.0
+    resume_at = 0.0
+    for fragment in fragments:
+        parts.append(fragment)
+        pending += 1
+        now = time.monotonic()
+        if now < resume_at:
+            continue
+        if ts is None or pending >= STREAM_UPDATE_FRAGMENTS or now - last_update >= STREAM_UPDATE_INTERVAL_SEC:
+            text = prefix + "".join(parts) + " ▍"
+            try:
+                if ts is None:
+                    ts = client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, text=text)['ts']
+                else:
+                    client.chat_update(channel=channel_id, ts=ts, text=text)
+            except SlackApiError as e:
+                retry_after = slack_retry_after(e)
+                if retry_after is not None:
+                    resume_at = now + retry_after
+                else:
+                    logger.warning(f"Could not update streamed answer: {e.response.get('error')}")
+            pending = 0
+            last_update = now
+    return "".join(parts), ts
+
+
+def slack_retry_after(error: SlackApiError):
+    """Seconds to wait before the next call if `error` is a rate limit, else None."""
+    if error.response.get('error') != 'ratelimited':
+        return None
+    try:
+        return float(error.response.headers.get('Retry-After', SLACK_RETRY_AFTER_SEC))
+    except (TypeError, ValueError):
+        return SLACK_RETRY_AFTER_SEC
+
+
+def discard_placeholder(client, channel_id: str, future):
+    """Make sure a placeholder that was given up on doesn't linger next to the answer.
+    
+    The post is cancelled if it hasn't started yet; otherwise the message is
+    deleted as soon as it has been posted.
+    """
+    if future.cancel():
+        return
+    
+    def delete(done):
+        if done.exception() is not None:
+            return  # Never posted, nothing to remove
+        try:
+            client.chat_delete(channel=channel_id, ts=done.result()['ts'])
+        except Exception as e:
+            logger.warning(f"Could not remove late placeholder message: {e!r}")
+    
+    future.add_done_callback(delete)
+
+
+def send_answer(client, channel_id: str, query: str, context: list, user_id: str,
+                thread_ts: str = None, ts: str = None, mention: bool = False):
+    """Generate the answer to a question and post it with its sources.
+    
+    With STREAM_RESPONSES the answer is streamed into the message `ts` (or a
+    new message); the final update adds the source citations. Otherwise the
+    complete answer replaces the message `ts`, or is posted as a new message.
+    
+    Args:
+        ts: Optional placeholder message to put the answer in
+        mention: Whether to mention the user in the reply (channel mentions)
+    """
+    prefix = f"<@{user_id}> " if mention else ""
+    
+    if STREAM_RESPONSES:
+        fragments = llama.stream_response(query=query, context=context, user_id=user_id, use_history=True)
+        response, ts = stream_to_slack(client, channel_id, fragments, ts, thread_ts, prefix)
+    else:
+        response = llama.generate_response(query=query, context=context, user_id=user_id, use_history=True)
+    
+    if not response.strip():
+        # Slack rejects messages without text
+        blocks = build_error_blocks(user_id if mention else None)
+        text = prefix + "Error"
+    else:
+        # Build response blocks using helper; without sources the full answer goes in plain text
+        blocks = build_response_blocks(response, context, user_id if mention else None)
+        if blocks:
+            text = prefix + (response[:100] + "..." if len(response) > 100 else response)
+        else:
+            text = prefix + response
+    
+    # The final message (which also drops the streaming cursor) is retried once after a rate limit
+    for attempt in range(2):
+        try:
+            if ts:
+                client.chat_update(channel=channel_id, ts=ts, blocks=blocks, text=text)
+            else:
+                client.chat_postMessage(channel=channel_id, thread_ts=thread_ts, blocks=blocks, text=text)
+            return
+        except SlackApiError as e:
+            retry_after = slack_retry_after(e)
+            if retry_after is None or attempt:
+                raise
+            time.sleep(retry_after)
+
 # Initialize Slack app
-app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
+app = App(
+    token=os.environ.get("SLACK_BOT_TOKEN"),
+    listener_executor=ThreadPoolExecutor(max_workers=BOT_WORKERS, thread_name_prefix="slack-listener")
+)
 
 # Initialize AI and Knowledge Base
 logger.info("Initializing Knowledge Base...")
 KB_PATH = os.environ.get("KNOWLEDGE_BASE_PATH", "./knowledge_base")
-kb = KnowledgeBase(knowledge_base_path=KB_PATH)
+kb = KnowledgeBase(
+    knowledge_base_path=KB_PATH,
+    embedding_backend=os.environ.get("EMBEDDING_BACKEND", "torch"),
+    embed_cache_dir=os.path.join(KB_PATH, ".embed_cache")
+)
 
-logger.info("Loading documents from knowledge base folder...")
-kb.load_documents_from_folder(KB_PATH)
+# Searches from concurrent events share one embedding forward pass
+kb_batcher = QueryBatcher(kb)
 
-# If a specific collection is forced (e.g., Springworks), try loading that folder
-if FORCE_KB_COLLECTION:
-    collection_folder = os.path.join(KB_PATH, FORCE_KB_COLLECTION)
-    if os.path.exists(collection_folder):
-        logger.info(f"Loading forced collection: {FORCE_KB_COLLECTION}")
-        kb.load_documents_from_folder(collection_folder, collection_name=FORCE_KB_COLLECTION)
-    else:
-        logger.warning(f"Forced collection folder not found: {collection_folder}")
+# Recent search results, so duplicate events and quick retries skip the KB lookup
+_search_cache = TTLCache(maxsize=1024, ttl=60)
+_search_cache_lock = threading.Lock()
+
+
+def cached_search(text: str, n_results: int = 3, collection_name: str = None, category: str = None) -> list:
+    """kb.search (through the query batcher), reusing results from the last minute.
+    
+    Queries that differ only in case or surrounding whitespace share an entry.
+    Only the first MAX_SEARCH_CHARS characters of the query are searched for.
+    """
+    if len(text) > MAX_SEARCH_CHARS:
+        logger.info(f"Query of {len(text)} characters truncated to {MAX_SEARCH_CHARS} for search")
+        text = text[:MAX_SEARCH_CHARS]
+    key = (text.strip().lower(), n_results, collection_name, category)
+    with _search_cache_lock:
+        cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    results = kb_batcher.search(text, n_results=n_results, collection_name=collection_name, category=category)
+    with _search_cache_lock:
+        _search_cache[key] = results
+    return results
 
 logger.info("Initializing Llama AI...")
 llama = LlamaAI(
     model=os.environ.get("OLLAMA_MODEL", "llama3.2:3b"),
-    base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+    base_url=os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"),
+    response_cache_ttl=float(os.environ.get("RESPONSE_CACHE_TTL_SEC", "0")) or None,
+    redis_url=os.environ.get("REDIS_URL"),
+    pool_size=BOT_WORKERS,
+    warmup_keep_alive=os.environ.get("WARMUP_KEEP_ALIVE")
 )
 
-# Check if model is available
-if not llama.check_model_availability():
-    logger.warning("Model not available. You may need to download it using: ollama pull llama3.2:3b")
-
 
 # Event listener for app mentions
 @app.event("app_mention")
@@ -228,52 +500,51 @@ def handle_mention(event, say, client):
         thread_ts = event.get('thread_ts', event['ts'])  # Get thread timestamp
         
         # Remove bot mention from text
-        bot_user_id = client.auth_test()['user_id']
-        text = re.sub(f'<@{bot_user_id}>', '', text).strip()
+        bot_user_id = get_bot_user_id(client)
+        text = strip_bot_mention(text, bot_user_id)
         
         if not text:
             say(text="Hi! How can I help you today?", thread_ts=thread_ts)
             return
+        if GREETING_RE.match(text):
+            say(text=f"<@{user_id}> {GREETING_REPLY}", thread_ts=thread_ts)
+            return
+        if is_trivial_message(text):
+            return
         
-        # Show typing indicator in the thread
-        client.chat_postMessage(
-            channel=channel_id,
-            thread_ts=thread_ts,
-            text=f"<@{user_id}> Searching knowledge base... 🔍"
-        )
+        # Show typing indicator in the thread when the answer isn't streamed;
+        # a streamed answer starts its own message with the first fragment
+        # (posted in the background while the KB search runs)
+        placeholder_future = None
+        if not STREAM_RESPONSES:
+            placeholder_future = EXECUTOR.submit(
+                client.chat_postMessage,
+                channel=channel_id,
+                thread_ts=thread_ts,
+                text=f"<@{user_id}> Searching knowledge base... 🔍"
+            )
         
-        # Decide which collection to search: forced override or intent detection
-        collection_to_use = FORCE_KB_COLLECTION or detect_collection_for_query(text)
+        # Load the model in Ollama while the KB search runs
+        EXECUTOR.submit(llama.warmup)
         
-        # Detect category for smarter filtering
-        lowered = text.lower()
-        detected_category = None
-        if sum(1 for kw in EMPLOYMENT_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'employment'
-        elif sum(1 for kw in EDUCATION_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'education'
-        elif sum(1 for kw in ADDRESS_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'address'
-        elif sum(1 for kw in CRIMINAL_KEYWORDS if kw in lowered) > 0 or sum(1 for kw in IDENTITY_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'compliance'
+        # Decide which collection and category to search
+        collection_to_use, detected_category = route(text)
         
         logger.info(f"Searching knowledge base for: {sanitize_for_logging(text)} (collection: {collection_to_use}, category: {detected_category})")
-        context = kb.search(text, n_results=10, collection_name=collection_to_use, category=detected_category)
+        context = cached_search(text, n_results=10, collection_name=collection_to_use, category=detected_category)
         
-        # Generate response
-        logger.info(f"Generating response for user {user_id}")
-        response = llama.generate_response(
-            query=text,
-            context=context,
-            user_id=user_id,
-            use_history=True
-        )
-        
-        # Build response blocks using helper
-        blocks = build_response_blocks(response, context, user_id)
+        placeholder_ts = None
+        if placeholder_future is not None:
+            try:
+                placeholder_ts = placeholder_future.result(timeout=PLACEHOLDER_TIMEOUT_SEC)['ts']
+            except Exception as e:
+                logger.warning(f"Placeholder message not posted, answering in a new message: {e!r}")
+                discard_placeholder(client, channel_id, placeholder_future)
         
-        # Send response in the thread with blocks
-        say(blocks=blocks, text=f"<@{user_id}> {response[:100]}...", thread_ts=thread_ts)
+        # Generate and send the response in the thread
+        logger.info(f"Generating response for user {user_id}")
+        send_answer(client, channel_id, text, context, user_id,
+                    thread_ts=thread_ts, ts=placeholder_ts, mention=True)
         
     except Exception as e:
         logger.error(f"Error handling mention: {e}")
@@ -285,100 +556,136 @@ def handle_mention(event, say, client):
 def handle_message(event, say, client):
     """Handle direct messages to the bot."""
     
-    # Ignore bot messages and threaded messages
-    if event.get('bot_id') or event.get('thread_ts'):
+    # Ignore bot messages, threaded messages and anything that isn't a direct message
+    if event.get('bot_id') or event.get('thread_ts') or event.get('channel_type') != 'im':
         return
     
-    # Only respond to direct messages
-    channel_type = event.get('channel_type')
-    if channel_type != 'im':
+    # Nothing to search for in empty or trivial messages
+    text = event.get('text', '').strip()
+    if not text or is_trivial_message(text):
+        return
+    if GREETING_RE.match(text):
+        say(text=GREETING_REPLY)
         return
     
     try:
-        text = event.get('text', '').strip()
         user_id = event['user']
         
-        if not text:
-            return
+        # Load the model in Ollama while the KB search runs
+        EXECUTOR.submit(llama.warmup)
         
-        # Search knowledge base with intent-based collection selection
-        collection_to_use = FORCE_KB_COLLECTION or detect_collection_for_query(text)
-        
-        # Detect category for smarter filtering
-        lowered = text.lower()
-        detected_category = None
-        if sum(1 for kw in EMPLOYMENT_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'employment'
-        elif sum(1 for kw in EDUCATION_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'education'
-        elif sum(1 for kw in ADDRESS_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'address'
-        elif sum(1 for kw in CRIMINAL_KEYWORDS if kw in lowered) > 0 or sum(1 for kw in IDENTITY_KEYWORDS if kw in lowered) > 0:
-            detected_category = 'compliance'
+        # Search knowledge base with intent-based collection and category selection
+        collection_to_use, detected_category = route(text)
         
         logger.info(f"DM - Searching knowledge base for: {sanitize_for_logging(text)} (collection: {collection_to_use}, category: {detected_category})")
-        context = kb.search(text, n_results=10, collection_name=collection_to_use, category=detected_category)
+        context = cached_search(text, n_results=10, collection_name=collection_to_use, category=detected_category)
         
-        # Generate response
+        # Generate and send the response
         logger.info(f"DM - Generating response for user {user_id}")
-        response = llama.generate_response(
-            query=text,
-            context=context,
-            user_id=user_id,
-            use_history=True
-        )
-        
-        # Build response blocks using helper
-        blocks = build_response_blocks(response, context)
-        
-        # Send response with blocks
-        say(blocks=blocks, text=response[:100] + "..." if len(response) > 100 else response)
+        send_answer(client, event['channel'], text, context, user_id)
         
     except Exception as e:
         logger.error(f"Error handling DM: {e}")
         say(blocks=build_error_blocks(), text="Error")
 
 
+# Static Block Kit layouts, built once; only the stats are filled in per request
+HELP_BLOCKS = [
+    {
+        "type": "header",
+        "text": {
+            "type": "plain_text",
+            "text": "🤖 Helpie Bot - Quick Guide"
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"*How to use:*\n• Mention me in a channel: `@Helpie your question`\n• Send me a direct message with your question\n• I'll search my knowledge base and provide crisp, relevant answers\n• Keep questions short: only the first {MAX_SEARCH_CHARS} characters are used to search"
+        }
+    },
+    {"type": "divider"},
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "*Available Commands:*\n• `/bot-help` - Show this help message\n• `/bot-stats` - View knowledge base statistics\n• `/bot-clear` - Clear your conversation history"
+        }
+    },
+    {"type": "divider"},
+    {
+        "type": "context",
+        "elements": [
+            {
+                "type": "mrkdwn",
+                "text": "✨ *Features:* Context-aware conversations • Knowledge base search • Source citations • Powered by Llama AI 🦙"
+            }
+        ]
+    }
+]
+
+CLEAR_BLOCKS = [
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "✅ *Done!* Your conversation history has been cleared."
+        }
+    }
+]
+
+HOME_HEADER_BLOCKS = [
+    {
+        "type": "header",
+        "text": {
+            "type": "plain_text",
+            "text": "🤖 Welcome to Your AI Assistant"
+        }
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "*I'm here to help answer your questions!*\n\nI use a custom knowledge base and Llama AI to provide accurate, context-aware responses."
+        }
+    },
+    {
+        "type": "divider"
+    }
+]
+
+HOME_FOOTER_BLOCKS = [
+    {
+        "type": "divider"
+    },
+    {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": "*💡 How to Use*\n• Mention me in any channel\n• Send me a direct message\n• Use `/bot-help` for more info"
+        }
+    }
+]
+
+
+def home_stats_section(stats: dict) -> dict:
+    """The home tab's only dynamic block: knowledge base stats."""
+    return {
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": f"*📊 Knowledge Base Stats*\n• Documents: {stats['total_documents']}\n• AI Model: `{llama.model}`"
+        }
+    }
+
+
 # Slash command: /bot-help
 @app.command("/bot-help")
 def handle_help_command(ack, respond):
     """Show help information."""
     ack()
-    blocks = [
-        {
-            "type": "header",
-            "text": {
-                "type": "plain_text",
-                "text": "🤖 Helpie Bot - Quick Guide"
-            }
-        },
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "*How to use:*\n• Mention me in a channel: `@Helpie your question`\n• Send me a direct message with your question\n• I'll search my knowledge base and provide crisp, relevant answers"
-            }
-        },
-        {"type": "divider"},
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "*Available Commands:*\n• `/bot-help` - Show this help message\n• `/bot-stats` - View knowledge base statistics\n• `/bot-clear` - Clear your conversation history"
-            }
-        },
-        {"type": "divider"},
-        {
-            "type": "context",
-            "elements": [
-                {
-                    "type": "mrkdwn",
-                    "text": "✨ *Features:* Context-aware conversations • Knowledge base search • Source citations • Powered by Llama AI 🦙"
-                }
-            ]
-        }
-    ]
-    respond(blocks=blocks, text="Helpie Bot Help")
+    respond(blocks=HELP_BLOCKS, text="Helpie Bot Help")
 
 
 # Slash command: /bot-stats
@@ -408,7 +715,7 @@ def handle_stats_command(ack, respond):
                 },
                 {
                     "type": "mrkdwn",
-                    "text": f"*Collection:*\n`{stats['collection_name']}`"
+                    "text": f"*Collections:*\n`{', '.join(stats['collections'])}`"
                 }
             ]
         }
@@ -423,16 +730,7 @@ def handle_clear_command(ack, respond, command):
     ack()
     user_id = command['user_id']
     llama.clear_history(user_id)
-    blocks = [
-        {
-            "type": "section",
-            "text": {
-                "type": "mrkdwn",
-                "text": "✅ *Done!* Your conversation history has been cleared."
-            }
-        }
-    ]
-    respond(blocks=blocks, text="History cleared")
+    respond(blocks=CLEAR_BLOCKS, text="History cleared")
 
 
 # Home tab
@@ -445,50 +743,31 @@ def update_home_tab(client, event):
             user_id=event["user"],
             view={
                 "type": "home",
-                "blocks": [
-                    {
-                        "type": "header",
-                        "text": {
-                            "type": "plain_text",
-                            "text": "🤖 Welcome to Your AI Assistant"
-                        }
-                    },
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": "*I'm here to help answer your questions!*\n\nI use a custom knowledge base and Llama AI to provide accurate, context-aware responses."
-                        }
-                    },
-                    {
-                        "type": "divider"
-                    },
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*📊 Knowledge Base Stats*\n• Documents: {stats['total_documents']}\n• AI Model: `{llama.model}`"
-                        }
-                    },
-                    {
-                        "type": "divider"
-                    },
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": "*💡 How to Use*\n• Mention me in any channel\n• Send me a direct message\n• Use `/bot-help` for more info"
-                        }
-                    }
-                ]
+                "blocks": HOME_HEADER_BLOCKS + [home_stats_section(stats)] + HOME_FOOTER_BLOCKS
             }
         )
     except Exception as e:
         logger.error(f"Error updating home tab: {e}")
 
 
-# Start the app
-if __name__ == "__main__":
+def load_knowledge_base():
+    """Index the knowledge base folder (if the index is empty).
+    
+    If a specific collection is forced (e.g., Springworks), only that folder is loaded.
+    """
+    collection_folder = os.path.join(KB_PATH, FORCE_KB_COLLECTION) if FORCE_KB_COLLECTION else None
+    if collection_folder and os.path.isdir(collection_folder):
+        logger.info(f"Loading forced collection: {FORCE_KB_COLLECTION}")
+        kb.load_documents_from_folder(collection_folder, collection_name=FORCE_KB_COLLECTION)
+    else:
+        if collection_folder:
+            logger.warning(f"Forced collection folder not found: {collection_folder}")
+        logger.info("Loading documents from knowledge base folder...")
+        kb.load_documents_from_folder(KB_PATH)
+
+
+def main():
+    """Load the knowledge base and start the bot in Socket Mode."""
     # Verify required environment variables
     required_vars = ["SLACK_BOT_TOKEN", "SLACK_APP_TOKEN"]
     missing_vars = [var for var in required_vars if not os.environ.get(var)]
@@ -498,9 +777,31 @@ if __name__ == "__main__":
         logger.error("Please check your .env file")
         exit(1)
     
+    load_knowledge_base()
+    
+    # Check if model is available
+    if not llama.check_model_availability():
+        logger.warning("Model not available. You may need to download it using: ollama pull llama3.2:3b")
+    
     logger.info("Starting Slack bot in Socket Mode...")
     logger.info(f"Knowledge Base: {kb.get_stats()['total_documents']} documents loaded")
+    # Parallelism is decided by the Ollama server; these only take effect when set for `ollama serve`
+    logger.info(
+        f"Ollama concurrency: OLLAMA_NUM_PARALLEL={os.environ.get('OLLAMA_NUM_PARALLEL', 'server default')}, "
+        f"OLLAMA_MAX_LOADED_MODELS={os.environ.get('OLLAMA_MAX_LOADED_MODELS', 'server default')}"
+    )
+    
+    # Resolve the bot user id up front so the first mention doesn't wait on auth.test
+    try:
+        get_bot_user_id(app.client)
+    except Exception as e:
+        logger.warning(f"Could not resolve bot user id at startup: {e}")
     
     # Start the bot
-    handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
-    handler.start()
\ No newline at end of file
+    handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"], concurrency=BOT_WORKERS)
+    handler.start()
+
+
+# Start the app
+if __name__ == "__main__":
+    main()
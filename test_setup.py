@@ -6,6 +6,7 @@ Run this before starting the Slack bot to ensure everything is set up properly.
 
 import sys
 import os
+import functools
 from dotenv import load_dotenv
 
 # Color codes for terminal output
@@ -84,6 +85,12 @@ def check_env_file():
     
     return all_set
 
+@functools.lru_cache(maxsize=1)
+def _list_models():
+    """Models reported by the local Ollama server (queried once per run)."""
+    import ollama
+    return ollama.list()
+
 def check_ollama():
     """Check if Ollama is installed and running."""
     print("\nChecking Ollama...")
@@ -93,20 +100,21 @@ def check_ollama():
         
         # Check if Ollama is running
         try:
-            models = ollama.list()
+            models = _list_models()
             print(f"{GREEN}✓ Ollama is running{RESET}")
             
-            # Check if model is downloaded
+            # Check if model is downloaded (exact name; untagged names mean ':latest')
             model_name = os.getenv('OLLAMA_MODEL', 'llama3.2:3b')
-            available_models = [m['name'] for m in models.get('models', [])]
+            available_models = {m.get('model') or m.get('name') for m in models.get('models', [])}
+            target = model_name if ':' in model_name else f"{model_name}:latest"
             
-            if any(model_name in m for m in available_models):
+            if target in available_models or model_name in available_models:
                 print(f"{GREEN}✓ Model {model_name} is available{RESET}")
                 return True
             else:
                 print(f"{YELLOW}⚠ Model {model_name} not found{RESET}")
                 print(f"{YELLOW}  Run: ollama pull {model_name}{RESET}")
-                print(f"{YELLOW}  Available models: {', '.join(available_models)}{RESET}")
+                print(f"{YELLOW}  Available models: {', '.join(sorted(filter(None, available_models)))}{RESET}")
                 return False
                 
         except Exception as e:
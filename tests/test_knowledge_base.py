@@ -3,18 +3,34 @@ import unittest
 import tempfile
 import shutil
 import os
-from knowledge_base_manager import KnowledgeBase
+import threading
+import numpy as np
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from knowledge_base_manager import KnowledgeBase, QueryBatcher
 
 
 class TestKnowledgeBase(unittest.TestCase):
-    def setUp(self):
-        """Create temporary directory for tests."""
-        self.test_dir = tempfile.mkdtemp()
-        self.kb = KnowledgeBase(knowledge_base_path=self.test_dir)
+    @classmethod
+    def setUpClass(cls):
+        """Create one temporary directory and knowledge base shared by all tests."""
+        cls.test_dir = tempfile.mkdtemp()
+        cls.kb = KnowledgeBase(knowledge_base_path=cls.test_dir)
     
-    def tearDown(self):
+    @classmethod
+    def tearDownClass(cls):
         """Clean up temporary directory."""
-        shutil.rmtree(self.test_dir)
+        shutil.rmtree(cls.test_dir)
+    
+    def setUp(self):
+        """Start each test from an empty directory and knowledge base."""
+        for entry in os.scandir(self.test_dir):
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        self.kb.clear()
+        self.kb._query_cache.clear()
     
     def test_add_text(self):
         """Test adding text to knowledge base."""
@@ -30,6 +46,7 @@ class TestKnowledgeBase(unittest.TestCase):
         results = self.kb.search("Python programming", n_results=1)
         self.assertEqual(len(results), 1)
         self.assertIn("Python", results[0]['content'])
+        self.assertEqual(results[0]['source'], "python.txt")
     
     def test_keyword_boosting(self):
         """Test that keyword matching boosts search results."""
@@ -67,6 +84,187 @@ class TestKnowledgeBase(unittest.TestCase):
         results = self.kb.search("Doc", n_results=10, collection_name="col1")
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['metadata']['collection'], 'col1')
+    
+    def test_folder_load_saves_once(self):
+        """Test that loading a folder writes the index once, including collection labels."""
+        folder = os.path.join(self.test_dir, "col1")
+        os.makedirs(folder)
+        for name in ("a.txt", "b.txt"):
+            with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+                f.write(f"Contents of {name}")
+        
+        with patch.object(self.kb, '_save_index', wraps=self.kb._save_index) as save:
+            self.kb.load_documents_from_folder(folder)
+        self.assertEqual(save.call_count, 1)
+        
+        kb2 = KnowledgeBase(knowledge_base_path=self.test_dir)
+        self.assertEqual(len(kb2.documents), 2)
+        self.assertTrue(all(m['collection'] == 'col1' for m in kb2.metadatas))
+    
+    def test_folder_load_bulk_extensions(self):
+        """Test that a bulk folder load adds to a non-empty KB, filters by extension and defers saving."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        folder = os.path.join(self.test_dir, "col1")
+        os.makedirs(folder)
+        for name in ("a.txt", "b.md"):
+            with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+                f.write(f"Contents of {name}")
+        
+        with patch.object(self.kb, '_save_index', wraps=self.kb._save_index) as save:
+            self.kb.load_documents_from_folder(folder, extensions={'.txt'}, bulk=True)
+            self.assertEqual(save.call_count, 0)
+            self.kb.flush()
+        self.assertEqual(save.call_count, 1)
+        self.assertEqual([m['source'] for m in self.kb.metadatas], ["emp.txt", "a.txt"])
+        self.assertEqual(self.kb.metadatas[1]['collection'], 'col1')
+    
+    def test_search_distance_matches_result(self):
+        """Test that each result's distance belongs to that result."""
+        self.kb.add_text("Python is a programming language.", metadata={"source": "python.txt"})
+        self.kb.add_text("Bananas are yellow fruit.", metadata={"source": "fruit.txt"})
+        
+        results = self.kb.search("bananas yellow fruit", n_results=2)
+        self.assertEqual(results[0]['source'], "fruit.txt")
+        self.assertLess(results[0]['distance'], results[1]['distance'])
+    
+    def test_query_embedding_cache(self):
+        """Test that repeated queries are only embedded once."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        
+        with patch.object(self.kb.embedding_model, 'encode', wraps=self.kb.embedding_model.encode) as encode:
+            first = self.kb.search("employment", n_results=1)
+            second = self.kb.search("employment", n_results=1)
+        
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(first, second)
+    
+    def test_add_pdfs_embeds_once(self):
+        """Test that add_pdfs embeds the chunks of all PDFs in a single batch."""
+        texts = {"EMP_PM.pdf": "Employment verification process", "EDU_PM.pdf": "Education verification process"}
+        with patch('knowledge_base_manager.os.cpu_count', return_value=1), \
+                patch('knowledge_base_manager.extract_pdf_text', side_effect=lambda path, parallel: texts[path]), \
+                patch.object(self.kb.embedding_model, 'encode', wraps=self.kb.embedding_model.encode) as encode:
+            self.kb.add_pdfs(list(texts), collections=["springworks", None])
+        
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(len(self.kb.documents), 2)
+        self.assertEqual(self.kb.metadatas[0]['category'], 'employment')
+        self.assertEqual(self.kb.metadatas[0]['collection'], 'springworks')
+        self.assertNotIn('collection', self.kb.metadatas[1])
+    
+    def test_embed_cache_skips_reencoding(self):
+        """Test that unchanged documents are embedded once across knowledge base rebuilds."""
+        cache_dir = os.path.join(self.test_dir, ".embed_cache")
+        kb = KnowledgeBase(knowledge_base_path=self.test_dir, embed_cache_dir=cache_dir)
+        kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        kb.clear()
+        
+        with patch.object(kb.embedding_model, 'encode', wraps=kb.embedding_model.encode) as encode:
+            kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+            self.assertEqual(encode.call_count, 0)
+            kb.add_text("Education verification process", metadata={"source": "edu.txt"})
+            self.assertEqual(encode.call_count, 1)
+        self.assertEqual(len(kb.search("employment", n_results=1)), 1)
+    
+    def test_prune_embed_cache(self):
+        """Test that a rebuild prunes cache files of documents that are gone."""
+        cache_dir = os.path.join(self.test_dir, ".embed_cache")
+        kb = KnowledgeBase(knowledge_base_path=self.test_dir, embed_cache_dir=cache_dir)
+        kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        kb.add_text("Education verification process", metadata={"source": "edu.txt"})
+        
+        # A reloaded index doesn't know which files it uses, so nothing is pruned
+        self.assertEqual(KnowledgeBase(knowledge_base_path=self.test_dir, embed_cache_dir=cache_dir).prune_embed_cache(), 0)
+        
+        kb.clear()
+        kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        self.assertEqual(kb.prune_embed_cache(), 1)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        
+        with patch.object(kb.embedding_model, 'encode', wraps=kb.embedding_model.encode) as encode:
+            kb.clear()
+            kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+            self.assertEqual(encode.call_count, 0)
+    
+    def test_reload_memory_maps_embeddings(self):
+        """Test that a reloaded index is memory-mapped and still accepts new documents."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        
+        reloaded = KnowledgeBase(knowledge_base_path=self.test_dir)
+        self.assertIsInstance(reloaded._emb, np.memmap)
+        self.assertEqual(len(reloaded.search("employment", n_results=1)), 1)
+        
+        reloaded.add_text("Education verification process", metadata={"source": "edu.txt"})
+        self.assertEqual(len(reloaded.embeddings), 2)
+        self.assertEqual(len(KnowledgeBase(knowledge_base_path=self.test_dir).embeddings), 2)
+    
+    def test_save_over_memory_mapped_index(self):
+        """Test that a reloaded (memory-mapped) index can be saved over its own file."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        
+        reloaded = KnowledgeBase(knowledge_base_path=self.test_dir)
+        self.assertIsInstance(reloaded._emb, np.memmap)
+        reloaded.metadatas[0]['collection'] = 'col1'
+        reloaded._save_index()
+        
+        self.assertNotIsInstance(reloaded._emb, np.memmap)
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "embeddings.npy.tmp")))
+        kb2 = KnowledgeBase(knowledge_base_path=self.test_dir)
+        self.assertEqual(kb2.metadatas[0]['collection'], 'col1')
+        np.testing.assert_array_equal(kb2.embeddings, self.kb.embeddings)
+        self.assertEqual(len(reloaded.search("employment", n_results=1)), 1)
+    
+    def test_reload_normalizes_unnormalized_embeddings(self):
+        """Test that an embeddings.npy without unit rows is normalized when loaded."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        self.kb.add_text("Education verification process", metadata={"source": "edu.txt"})
+        expected = [r['source'] for r in self.kb.search("verification", n_results=2)]
+        
+        # Scale the rows very differently, as an older or foreign index might store them
+        np.save(os.path.join(self.test_dir, "embeddings.npy"), self.kb.embeddings * np.array([[1.0], [1000.0]], dtype=np.float32))
+        
+        reloaded = KnowledgeBase(knowledge_base_path=self.test_dir)
+        self.assertNotIsInstance(reloaded._emb, np.memmap)
+        np.testing.assert_allclose(np.linalg.norm(reloaded.embeddings, axis=1), 1.0, atol=1e-5)
+        self.assertEqual([r['source'] for r in reloaded.search("verification", n_results=2)], expected)
+    
+    def test_query_batcher(self):
+        """Test that concurrent batched searches match direct searches."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        self.kb.add_text("Education verification process", metadata={"source": "edu.txt"})
+        batcher = QueryBatcher(self.kb, window=0.05)
+        
+        queries = ["employment", "education", "verification", "employment"]
+        with ThreadPoolExecutor(max_workers=len(queries)) as pool:
+            batched = list(pool.map(lambda q: batcher.search(q, n_results=1), queries))
+        
+        self.assertEqual(batched, [self.kb.search(q, n_results=1) for q in queries])
+    
+    def test_query_batcher_falls_back_to_direct_search(self):
+        """Test that failed or stalled batch embeddings fall back to a direct search."""
+        self.kb.add_text("Employment verification process", metadata={"source": "emp.txt"})
+        expected = self.kb.search("employment", n_results=1)
+        batcher = QueryBatcher(self.kb, window=0.0, timeout=0.05)
+        encode_queries = self.kb.encode_queries
+        release = threading.Event()
+        
+        def failing_in_batcher(mode):
+            def encode(queries):
+                if threading.current_thread().name == "kb-query-batcher":
+                    if mode == "stall":
+                        release.wait(5)
+                    raise RuntimeError("encoder failed")
+                return encode_queries(queries)
+            return encode
+        
+        for mode in ("fail", "stall"):
+            with patch.object(self.kb, 'encode_queries', side_effect=failing_in_batcher(mode)):
+                self.assertEqual(batcher.search("employment", n_results=1), expected)
+            release.set()
+        
+        # The batch loop survives errors
+        self.assertTrue(batcher._worker.is_alive())
+        self.assertEqual(batcher.search("employment", n_results=1), expected)
 
 
 if __name__ == '__main__':
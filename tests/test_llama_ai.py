@@ -1,14 +1,14 @@
 """Unit tests for llama_ai.py"""
 import unittest
 from unittest.mock import Mock, patch
-from llama_ai import LlamaAI
+import ollama
+from llama_ai import LlamaAI, NO_CONTEXT_NOTE
 
 
-class TestLlamaAI(unittest.TestCase):
-    def setUp(self):
-        """Set up test fixtures."""
-        with patch('llama_ai.ollama.Client'):
-            self.llama = LlamaAI(model="test-model", base_url="http://test:11434")
+class TestSanitize(unittest.TestCase):
+    """Tests of the static sanitizers, which need no LlamaAI instance."""
+    # Over-long input for the length limit test, built once
+    _LONG_INPUT = "a" * 20000
     
     def test_sanitize_input(self):
         """Test input sanitization."""
@@ -16,10 +16,10 @@ class TestLlamaAI(unittest.TestCase):
         dirty = "Hello\x00World\x1f"
         clean = LlamaAI._sanitize_input(dirty)
         self.assertEqual(clean, "HelloWorld")
+        self.assertEqual(LlamaAI._sanitize_input("Caf\u00e9\x00\x85\x7f ok"), "Caf\u00e9 ok")
         
         # Test length limiting
-        long_text = "a" * 20000
-        clean = LlamaAI._sanitize_input(long_text)
+        clean = LlamaAI._sanitize_input(self._LONG_INPUT)
         self.assertEqual(len(clean), 10000)
     
     def test_sanitize_error(self):
@@ -33,40 +33,173 @@ class TestLlamaAI(unittest.TestCase):
         error = Exception("Connection refused")
         sanitized = LlamaAI._sanitize_error(error)
         self.assertEqual(sanitized, "Unable to connect to the AI service")
+        
+        # Keywords inside file paths don't pick the error category
+        error = Exception("Error in /srv/connection_pool.py and /opt/timeout_handler")
+        sanitized = LlamaAI._sanitize_error(error)
+        self.assertEqual(sanitized, "An error occurred while processing your request")
+
+
+class TestLlamaAI(unittest.TestCase):
+    # KB context fixture and the parts of it the formatted block must contain
+    _CTX = [{'content': 'Python is a programming language', 'metadata': {'source': 'python.txt'}}]
+    _CTX_REQUIRED = ("Python is a programming language", "python.txt", "KNOWLEDGE BASE CONTEXT")
+    
+    @classmethod
+    def setUpClass(cls):
+        """Patch the Ollama client once for all tests."""
+        cls._client_spec = ollama.Client
+        cls._client_patcher = patch('llama_ai.ollama.Client')
+        cls.mock_client = cls._client_patcher.start()
     
-    def test_build_prompt_no_context(self):
-        """Test prompt building without context."""
-        prompt = self.llama._build_prompt("What is Python?", context=None)
-        self.assertIn("What is Python?", prompt)
-        self.assertIn("general knowledge", prompt)
-    
-    def test_build_prompt_with_context(self):
-        """Test prompt building with context."""
-        context = [
-            {
-                'content': 'Python is a programming language',
-                'metadata': {'source': 'python.txt'}
-            }
-        ]
-        prompt = self.llama._build_prompt("What is Python?", context=context)
-        self.assertIn("Python is a programming language", prompt)
-        self.assertIn("python.txt", prompt)
-        self.assertIn("KNOWLEDGE BASE CONTEXT", prompt)
-    
-    @patch('llama_ai.ollama.Client')
-    def test_generate_response_sanitizes_input(self, mock_client):
+    @classmethod
+    def tearDownClass(cls):
+        cls._client_patcher.stop()
+    
+    def setUp(self):
+        """Set up test fixtures with a fresh mock client instance."""
+        # Spec'd on the real client, so a misspelled client method fails the test
+        self.mock_client.return_value = Mock(spec=self._client_spec)
+        self.llama = LlamaAI(model="test-model", base_url="http://test:11434")
+    
+    def test_format_kb_block_no_context(self):
+        """Test KB block formatting without context."""
+        block = self.llama._format_kb_block(context=None)
+        self.assertIn("general knowledge", block)
+    
+    def test_format_kb_block_with_context(self):
+        """Test KB block formatting with context."""
+        block = self.llama._format_kb_block(context=self._CTX)
+        missing = [required for required in self._CTX_REQUIRED if required not in block]
+        self.assertEqual(missing, [])
+        
+        # The same chunks reuse the formatted block
+        self.assertIs(self.llama._format_kb_block(context=[dict(ctx) for ctx in self._CTX]), block)
+    
+    def test_build_messages_layout(self):
+        """Test that the KB context sits between the stable prefix and the question."""
+        self.llama._store_history("U1", "Earlier question", "Earlier answer")
+        history = self.llama._recent_history("U1")
+        messages = self.llama._build_messages("What is Python?", self._CTX, history)
+        
+        self.assertEqual([m['role'] for m in messages], ['system', 'user', 'assistant', 'system', 'user'])
+        self.assertIn("Python is a programming language", messages[-2]['content'])
+        self.assertEqual(messages[-1]['content'], "What is Python?")
+        
+        # The system prompt does not depend on the question or its context
+        other = self.llama._build_messages("Something else", None, history)
+        self.assertEqual(messages[:3], other[:3])
+        self.assertEqual(other[-2], {'role': 'system', 'content': NO_CONTEXT_NOTE})
+    
+    def test_generate_response_sanitizes_input(self):
         """Test that generate_response sanitizes input."""
-        mock_instance = Mock()
-        mock_client.return_value = mock_instance
-        mock_instance.chat.return_value = {
+        self.llama.client.chat.return_value = {
             'message': {'content': 'Test response'}
         }
         
-        llama = LlamaAI()
         # Try with control characters
-        response = llama.generate_response("Hello\x00World")
+        response = self.llama.generate_response("Hello\x00World")
         # Should not raise an error and should sanitize
         self.assertIsNotNone(response)
+    
+    def test_generate_responses(self):
+        """Test that generate_responses answers every question, in order."""
+        self.llama.client.chat.side_effect = lambda model, messages, options: {
+            'message': {'content': f"Answer to {messages[-1]['content']}"}
+        }
+        
+        answers = self.llama.generate_responses(["q1", "q2", "q3"])
+        self.assertEqual(answers, ["Answer to q1", "Answer to q2", "Answer to q3"])
+        self.assertEqual(self.llama.client.chat.call_count, 3)
+        self.assertEqual(self.llama.generate_responses([]), [])
+    
+    def test_check_model_availability(self):
+        """Test that model availability uses exact names, not substrings."""
+        self.llama.client.list.return_value = {'models': [{'model': 'test-model:latest'}, {'model': 'llama3.2:3b'}]}
+        self.assertTrue(self.llama.check_model_availability())
+        
+        self.llama.model = "llama3"
+        self.assertFalse(self.llama.check_model_availability())
+    
+    def test_warmup_is_throttled(self):
+        """Test that back-to-back warmups only load the model once."""
+        self.llama.warmup()
+        self.llama.warmup()
+        self.llama.client.generate.assert_called_once_with(model="test-model", prompt='')
+    
+    def test_warmup_keep_alive(self):
+        """Test that a configured keep_alive is sent with the warmup."""
+        self.llama.warmup_keep_alive = "10m"
+        self.llama.warmup()
+        self.llama.client.generate.assert_called_once_with(model="test-model", prompt='', keep_alive="10m")
+    
+    def test_history_is_bounded(self):
+        """Test that conversation history keeps only the last 10 messages."""
+        for i in range(6):
+            self.llama._store_history("U1", f"question {i}", f"answer {i}")
+        history = self.llama.conversation_history["U1"]
+        self.assertEqual(len(history), 10)
+        self.assertEqual(history[0]['content'], "question 1")
+        self.assertEqual(history[-1]['content'], "answer 5")
+    
+    def test_redis_history(self):
+        """Test that history goes through Redis when it is configured."""
+        self.llama._redis = Mock()
+        self.llama._redis.lrange.return_value = ['{"role": "user", "content": "question"}']
+        
+        self.llama._store_history("U1", "question", "answer")
+        pipe = self.llama._redis.pipeline.return_value
+        pipe.ltrim.assert_called_once_with("hist:U1", -10, -1)
+        pipe.execute.assert_called_once()
+        self.assertNotIn("U1", self.llama.conversation_history)
+        
+        self.assertEqual(self.llama._recent_history("U1"), [{'role': 'user', 'content': 'question'}])
+        
+        # One history read per answer, shared by the cache check and the prompt
+        self.llama._redis.lrange.reset_mock()
+        self.llama.client.chat.return_value = {'message': {'content': 'Answer'}}
+        self.llama.generate_response("Next question", user_id="U1")
+        self.llama._redis.lrange.assert_called_once()
+        self.assertEqual(self.llama.client.chat.call_args.kwargs['messages'][1], {'role': 'user', 'content': 'question'})
+    
+    def test_stream_response(self):
+        """Test that stream_response yields fragments and records the full answer."""
+        self.llama.client.chat.return_value = iter([
+            {'message': {'content': 'Hello'}},
+            {'message': {'content': ' world'}},
+        ])
+        
+        parts = list(self.llama.stream_response("Hi there", user_id="U1"))
+        self.assertEqual(parts, ['Hello', ' world'])
+        self.assertTrue(self.llama.client.chat.call_args.kwargs['stream'])
+        self.assertEqual(self.llama.conversation_history["U1"][-1]['content'], 'Hello world')
+    
+    def test_response_cache(self):
+        """Test that a repeated question over the same context skips Ollama."""
+        self.llama.client.chat.return_value = {
+            'message': {'content': 'Cached answer'}
+        }
+        
+        context = [{'content': 'Employment is verified via HR.', 'metadata': {'source': 'hr.pdf'}}]
+        first = self.llama.generate_response("How do I verify employment?", context, use_history=False)
+        second = self.llama.generate_response("How do I verify employment?", context, use_history=False)
+        self.assertEqual(first, second)
+        self.assertEqual(self.llama.client.chat.call_count, 1)
+        
+        # Different retrieved chunks mean a different answer
+        other = [{'content': 'Something else.', 'metadata': {'source': 'x.pdf'}}]
+        self.llama.generate_response("How do I verify employment?", other, use_history=False)
+        self.assertEqual(self.llama.client.chat.call_count, 2)
+        
+        # So does the same text from a different source
+        moved = [{'content': 'Employment is verified via HR.', 'metadata': {'source': 'policy.pdf'}}]
+        self.llama.generate_response("How do I verify employment?", moved, use_history=False)
+        self.assertEqual(self.llama.client.chat.call_count, 3)
+        
+        # The key is taken after sanitizing, so control characters don't defeat the cache
+        self.llama.generate_response("Hello\x00World")
+        self.llama.generate_response("HelloWorld")
+        self.assertEqual(self.llama.client.chat.call_count, 4)
 
 
 if __name__ == '__main__':